@@ -0,0 +1,229 @@
+"""Hot/cold archival of old exams.
+
+Exams older than ``ARCHIVE_AFTER_DAYS`` (730 by default) are moved out of the
+``exams`` collection into ``exams_archive``, where each one is stored as a
+zlib-compressed BSON payload next to the few fields needed to find it
+(id, patient_id, exam_date, image ids). Their images and renditions move
+under ``archive/`` in blob storage, byte for byte. Setting
+``ARCHIVE_IMAGE_QUALITY`` (or passing a quality) opts in to re-encoding
+them as JPEG at that quality, kept only when smaller.
+
+Reads fall through to the archive (see ``find_exam``/``find_exam_by_image``
+in server.py), so archived exams can still be opened, exported and have their
+images served; default exam lists only cover the hot collection. Writing to
+an archived exam restores it to the hot collection first.
+
+The job runs in bounded batches from ``POST /api/archive/run`` or, for the
+whole backlog, from the command line:
+
+    python archive.py [--older-than-days 730] [--limit 1000] [--image-quality 75]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import mimetypes
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import PurePosixPath
+from typing import List, Optional, Tuple
+
+import bson
+from bson.codec_options import CodecOptions
+from starlette.concurrency import run_in_threadpool
+
+import revisions
+from storage import (
+    ARCHIVE_AREA, RENDITION_WIDTHS, BlobNotFound, BlobStorage, is_archived_key, key_from_path, rendition_key
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "730"))
+# Lossy re-encoding of archived images is opt-in; unset keeps them as uploaded
+ARCHIVE_IMAGE_QUALITY = int(os.environ["ARCHIVE_IMAGE_QUALITY"]) if os.environ.get("ARCHIVE_IMAGE_QUALITY") else None
+
+_CODEC_OPTIONS = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+
+
+async def ensure_indexes(db):
+    # The archival cutoff and the default exam list both sort on exam_date
+    await db.exams.create_index([("exam_date", -1)])
+    await db.exams_archive.create_index("id", unique=True)
+    await db.exams_archive.create_index("image_ids")
+    await db.exams_archive.create_index([("patient_id", 1), ("exam_date", -1)])
+
+
+def compress_exam(exam: dict) -> dict:
+    """Archive record for an exam document (without Mongo's _id)"""
+    exam = {key: value for key, value in exam.items() if key != "_id"}
+    return {
+        "id": exam["id"],
+        "patient_id": exam.get("patient_id"),
+        "exam_date": exam.get("exam_date"),
+        "image_ids": [image["id"] for image in exam.get("images", [])],
+        "archived_at": datetime.now(timezone.utc),
+        "payload": zlib.compress(bson.encode(exam), 6),
+    }
+
+
+def decompress_exam(record: dict) -> dict:
+    return bson.decode(zlib.decompress(record["payload"]), codec_options=_CODEC_OPTIONS)
+
+
+def recompress_image(data: bytes, quality: int) -> Optional[bytes]:
+    """JPEG re-encode of an image, or None when it would not be smaller"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            output = io.BytesIO()
+            img.save(output, "JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Keeping original image, cannot recompress: {e}")
+        return None
+    recompressed = output.getvalue()
+    return recompressed if len(recompressed) < len(data) else None
+
+
+def _archive_image(storage: BlobStorage, image: dict,
+                   quality: Optional[int]) -> Tuple[dict, List[str], List[str]]:
+    """Copy an image and its renditions to the archive area (blocking).
+
+    Returns the updated image record, the keys written, and the hot keys to
+    delete once the exam is archived.
+    """
+    key = key_from_path(image["path"])
+    if is_archived_key(key):
+        # Restored exams keep their images in the archive area
+        return image, [], []
+    try:
+        data = storage.get(key)
+    except BlobNotFound:
+        return image, [], []
+
+    recompressed = recompress_image(data, quality) if quality is not None else None
+    if recompressed is not None:
+        new_key = f"{ARCHIVE_AREA}/{PurePosixPath(key).with_suffix('.jpg')}"
+        storage.put(new_key, recompressed, "image/jpeg")
+        filename = str(PurePosixPath(image["filename"]).with_suffix(".jpg"))
+        image = {**image, "path": new_key, "filename": filename}
+    else:
+        new_key = f"{ARCHIVE_AREA}/{key}"
+        storage.put(new_key, data, mimetypes.guess_type(key)[0])
+        image = {**image, "path": new_key}
+    written, moved = [new_key], [key]
+
+    for width in RENDITION_WIDTHS:
+        old_rendition = rendition_key(key, image["id"], width)
+        try:
+            rendition = storage.get(old_rendition)
+        except BlobNotFound:
+            continue
+        new_rendition = rendition_key(new_key, image["id"], width)
+        storage.put(new_rendition, rendition, "image/jpeg")
+        written.append(new_rendition)
+        moved.append(old_rendition)
+    return image, written, moved
+
+
+async def archive_exam(db, storage: BlobStorage, exam: dict, quality: Optional[int] = None) -> bool:
+    """Move one exam to the archive; False if it changed while being archived"""
+    written, moved = [], []
+    images = []
+    for image in exam.get("images", []):
+        image, image_written, image_moved = await run_in_threadpool(_archive_image, storage, image, quality)
+        written.extend(image_written)
+        moved.extend(image_moved)
+        images.append(image)
+    exam = {**exam, "images": images}
+
+    await db.exams_archive.replace_one({"id": exam["id"]}, compress_exam(exam), upsert=True)
+    # Only drop the hot copy if nobody edited it in the meantime
+    result = await db.exams.delete_one({"id": exam["id"], "revision": exam.get("revision")})
+    if result.deleted_count == 0:
+        await db.exams_archive.delete_one({"id": exam["id"]})
+        for key in written:
+            await run_in_threadpool(storage.delete, key)
+        return False
+
+    for key in moved:
+        await run_in_threadpool(storage.delete, key)
+    return True
+
+
+async def run_archival(db, storage: BlobStorage, older_than_days: int = ARCHIVE_AFTER_DAYS,
+                       limit: Optional[int] = None, quality: Optional[int] = ARCHIVE_IMAGE_QUALITY) -> dict:
+    """Archive up to ``limit`` exams whose exam_date is older than the cutoff"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    # Range queries only match values of the same BSON type, so also cover
+    # exams not yet converted by migrate_datetimes.py
+    query = {"$or": [
+        {"exam_date": {"$lt": cutoff}},
+        {"exam_date": {"$type": "string", "$lt": cutoff.isoformat()}}
+    ]}
+    cursor = db.exams.find(query, {"_id": 0}).sort("exam_date", 1).batch_size(100)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    archived = skipped = 0
+    async for exam in cursor:
+        if await archive_exam(db, storage, exam, quality):
+            archived += 1
+        else:
+            skipped += 1
+    logger.info(f"Archived {archived} exams older than {cutoff.date()} ({skipped} skipped, changed meanwhile)")
+    has_more = await db.exams.find_one(query, {"_id": 1}) is not None
+    return {"cutoff": cutoff, "archived": archived, "skipped": skipped, "has_more": has_more}
+
+
+async def find_archived(db, query: dict) -> Optional[dict]:
+    record = await db.exams_archive.find_one(query, {"payload": 1})
+    return decompress_exam(record) if record else None
+
+
+async def restore_exam(db, exam_id: str) -> Optional[dict]:
+    """Move an archived exam back to the hot collection (its images stay in archive/)"""
+    exam = await find_archived(db, {"id": exam_id})
+    if exam is None:
+        return None
+    # A fresh revision, so sync clients that loaded after it was archived get it back
+    async with revisions.reserve(db) as revision:
+        exam.update(revision=revision, updated_at=datetime.now(timezone.utc))
+        await db.exams.replace_one({"id": exam_id}, exam, upsert=True)
+    await db.exams_archive.delete_one({"id": exam_id})
+    return exam
+
+
+def main():
+    import database
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description="Move old exams to the cold archive")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--limit", type=int, default=None, help="archive at most this many exams")
+    parser.add_argument("--image-quality", type=int, default=ARCHIVE_IMAGE_QUALITY,
+                        help="re-encode archived images as JPEG at this quality (lossy)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    async def run():
+        database.connect()
+        try:
+            await ensure_indexes(database.db)
+            await run_archival(database.db, get_storage(), args.older_than_days, args.limit, args.image_quality)
+        finally:
+            database.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
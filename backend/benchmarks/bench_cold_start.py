@@ -0,0 +1,97 @@
+"""Measure the cold-start cost of importing the backend.
+
+Each measurement runs in a fresh interpreter, as a new uvicorn worker would.
+Reports the median wall time of ``import server``, the heaviest imports from
+``python -X importtime``, and the deferred cost paid on the first export
+(python-docx via ``report``) and first image processing (Pillow).
+
+Run from the backend directory:
+
+    python benchmarks/bench_cold_start.py [--runs 10] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+ENV = dict(
+    os.environ,
+    MONGO_URL=os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+    DB_NAME=os.environ.get("DB_NAME", "benchmark"),
+)
+
+
+def time_import(statement: str, runs: int) -> float:
+    """Median wall time in ms of running ``statement`` in a fresh interpreter"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=BACKEND_DIR, env=ENV, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def import_profile(statement: str, top: int):
+    """Modules imported directly by ``server``, by cumulative import time (ms)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=BACKEND_DIR, env=ENV, check=True, capture_output=True, text=True
+    )
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is shown by two spaces per level; keep server's direct imports
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth != 1:
+            continue
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(cumulative) / 1000
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def deferred_cost(module: str, runs: int) -> float:
+    """Median ms to import ``module`` once server is already loaded"""
+    statement = (
+        "import time, server; start = time.perf_counter(); "
+        f"import {module}; print((time.perf_counter() - start) * 1000)"
+    )
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", statement],
+            cwd=BACKEND_DIR, env=ENV, check=True, capture_output=True, text=True
+        )
+        timings.append(float(result.stdout.strip()))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    baseline = time_import("pass", args.runs)
+    server = time_import("import server", args.runs)
+    print(f"interpreter startup      {baseline:8.1f} ms")
+    print(f"import server            {server:8.1f} ms  ({server - baseline:.1f} ms over startup)")
+
+    print(f"\nheaviest imports of `server` (cumulative, top {args.top}):")
+    for package, ms in import_profile("import server", args.top):
+        print(f"  {package:<24} {ms:8.1f} ms")
+
+    print("\ndeferred until first use:")
+    for label, module in (("report (python-docx)", "report"), ("PIL.Image", "PIL.Image")):
+        print(f"  {label:<24} {deferred_cost(module, args.runs):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
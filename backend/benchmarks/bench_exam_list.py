@@ -0,0 +1,113 @@
+"""Benchmark the GET /api/exams serialization paths on a 1000-exam list.
+
+Compares the previous path (parse_from_mongo, one Exam model per row, then
+FastAPI re-validating against response_model and encoding with json) with the
+trusted path (stored documents handed straight to ORJSONResponse).
+
+Run from the backend directory:
+
+    python benchmarks/bench_exam_list.py [--exams 1000] [--rounds 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from server import Exam, parse_from_mongo, trusted_response  # noqa: E402
+
+ORGANS = [
+    "Estômago", "Fígado", "Baço", "Rim Esquerdo", "Rim Direito",
+    "Vesícula Urinária", "Adrenal Esquerda", "Adrenal Direita",
+    "Duodeno", "Jejuno", "Cólon", "Ceco", "Íleo", "Linfonodos"
+]
+
+
+def make_exam_doc(index: int) -> dict:
+    """Build an exam document shaped like the ones stored in Mongo"""
+    exam_date = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=index)
+    organs_data = [
+        {
+            "organ_name": organ,
+            "measurements": {
+                f"medida_{m}": {"value": 1.0 + m / 10, "unit": "cm", "is_abnormal": False}
+                for m in range(3)
+            },
+            "selected_findings": ["normal"],
+            "custom_notes": "",
+            "report_text": "com dimensões, contornos, ecogenicidade e ecotextura preservados {MEDIDA}.",
+        }
+        for organ in ORGANS
+    ]
+    return {
+        "id": str(uuid.uuid4()),
+        "patient_id": str(uuid.uuid4()),
+        "exam_date": exam_date,
+        "exam_weight": 12.5,
+        "organs_data": organs_data,
+        "images": [],
+        "final_report": "",
+        "created_at": exam_date,
+    }
+
+
+def validated_path(docs: List[dict], adapter: TypeAdapter) -> bytes:
+    exams = [Exam(**parse_from_mongo(dict(d))) for d in docs]
+    # What FastAPI does with response_model=List[Exam]
+    value = adapter.validate_python(exams, from_attributes=True)
+    content = adapter.dump_python(value, mode="json")
+    return JSONResponse(content).body
+
+
+def trusted_path(docs: List[dict], adapter: TypeAdapter) -> bytes:
+    return trusted_response(docs).body
+
+
+def measure(fn, docs, adapter, rounds: int) -> List[float]:
+    fn(docs, adapter)  # warm up
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(docs, adapter)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--exams", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    docs = [make_exam_doc(i) for i in range(args.exams)]
+    adapter = TypeAdapter(List[Exam])
+
+    results = {
+        "validated (before)": measure(validated_path, docs, adapter, args.rounds),
+        "trusted (orjson)": measure(trusted_path, docs, adapter, args.rounds),
+    }
+
+    print(f"{args.exams} exams x {len(ORGANS)} organs, {args.rounds} rounds")
+    for name, timings in results.items():
+        print(
+            f"  {name:<20} median {statistics.median(timings):8.2f} ms"
+            f"   min {min(timings):8.2f} ms"
+        )
+    before = statistics.median(results["validated (before)"])
+    after = statistics.median(results["trusted (orjson)"])
+    print(f"  speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
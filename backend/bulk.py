@@ -0,0 +1,322 @@
+"""Streaming bulk export and import of clinic data.
+
+Collections are walked with a cursor in batches and written out as they are
+read, so memory use is bounded by the batch size rather than the collection
+size. Two formats are supported:
+
+* NDJSON: one ``{"collection": ..., "doc": ...}`` object per line, any number
+  of datasets in a single stream.
+* Parquet: one dataset per file, one row group per batch, with a fixed schema.
+  Nested fields (organs_data, images, formatting) are stored as JSON strings.
+  Requires pyarrow, which is imported on first use.
+
+``exam_measurements`` is a derived, export-only dataset with one row per organ
+measurement, for analysis in pandas or a spreadsheet.
+
+Imports are validated against the API models and upserted by id in batches
+(``BulkImporter``); rows that fail validation or writing are reported with
+their line/row number instead of aborting the import.
+"""
+import importlib.util
+import io
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+import revisions
+from archive import decompress_exam
+
+# Dataset -> ordered (column, type) pairs; types: string, float, int, bool, timestamp, json
+DATASETS = {
+    "patients": [
+        ("id", "string"), ("name", "string"), ("species", "string"), ("breed", "string"),
+        ("weight", "float"), ("size", "string"), ("sex", "string"), ("is_neutered", "bool"),
+        ("owner_name", "string"), ("created_at", "timestamp"),
+        ("revision", "int"), ("updated_at", "timestamp"),
+    ],
+    "exams": [
+        ("id", "string"), ("patient_id", "string"), ("exam_date", "timestamp"),
+        ("exam_weight", "float"), ("organs_data", "json"), ("images", "json"),
+        ("final_report", "string"), ("created_at", "timestamp"),
+        ("revision", "int"), ("updated_at", "timestamp"),
+    ],
+    "exam_measurements": [
+        ("exam_id", "string"), ("patient_id", "string"), ("exam_date", "timestamp"),
+        ("organ_name", "string"), ("measurement", "string"), ("value", "float"),
+        ("unit", "string"), ("is_abnormal", "bool"),
+    ],
+    "templates": [
+        ("id", "string"), ("organ", "string"), ("category", "string"), ("title", "string"),
+        ("text", "string"), ("formatting", "json"), ("order", "int"),
+        ("revision", "int"), ("updated_at", "timestamp"),
+    ],
+    "reference_values": [
+        ("id", "string"), ("organ", "string"), ("measurement_type", "string"),
+        ("species", "string"), ("size", "string"), ("min_value", "float"),
+        ("max_value", "float"), ("unit", "string"),
+        ("revision", "int"), ("updated_at", "timestamp"),
+    ],
+}
+
+# Datasets that can be imported back (exam_measurements is derived from exams)
+IMPORTABLE = ("patients", "exams", "templates", "reference_values")
+
+MAX_REPORTED_ERRORS = 100
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+def parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def flatten_measurements(exam: dict) -> Iterator[dict]:
+    """One row per organ measurement of an exam"""
+    for organ in exam.get("organs_data") or []:
+        for name, measurement in (organ.get("measurements") or {}).items():
+            yield {
+                "exam_id": exam.get("id"),
+                "patient_id": exam.get("patient_id"),
+                "exam_date": exam.get("exam_date"),
+                "organ_name": organ.get("organ_name"),
+                "measurement": name,
+                "value": measurement.get("value"),
+                "unit": measurement.get("unit"),
+                "is_abnormal": measurement.get("is_abnormal", False),
+            }
+
+
+async def iter_batches(db, dataset: str, batch_size: int) -> AsyncIterator[List[dict]]:
+    """Walk a dataset with a cursor, yielding lists of at most ``batch_size`` rows"""
+    # Exam datasets include exams moved to the cold archive
+    sources = ["exams", "exams_archive"] if dataset in ("exams", "exam_measurements") else [dataset]
+    batch = []
+    for source in sources:
+        cursor = db[source].find({}, {"_id": 0}).batch_size(batch_size)
+        async for doc in cursor:
+            if source == "exams_archive":
+                doc = decompress_exam(doc)
+            if dataset == "exam_measurements":
+                batch.extend(flatten_measurements(doc))
+            else:
+                batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def ndjson_stream(db, datasets: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    for dataset in datasets:
+        async for batch in iter_batches(db, dataset, batch_size):
+            yield b"".join(
+                orjson.dumps({"collection": dataset, "doc": doc}) + b"\n" for doc in batch
+            )
+
+
+def _timestamp(value: Any) -> Optional[datetime]:
+    # Records written before native BSON dates may still hold ISO strings
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _encode_row(columns, doc: dict) -> dict:
+    row = {}
+    for name, kind in columns:
+        value = doc.get(name)
+        if value is not None:
+            if kind == "json":
+                value = orjson.dumps(value).decode()
+            elif kind == "timestamp":
+                value = _timestamp(value)
+        row[name] = value
+    return row
+
+
+def decode_row(dataset: str, row: dict) -> dict:
+    """Turn a Parquet row back into a document (JSON columns parsed, nulls dropped)"""
+    doc = {}
+    for name, kind in DATASETS[dataset]:
+        value = row.get(name)
+        if value is None:
+            continue
+        doc[name] = orjson.loads(value) if kind == "json" else value
+    return doc
+
+
+def parquet_schema(dataset: str):
+    import pyarrow as pa
+
+    types = {
+        "string": pa.string(),
+        "json": pa.string(),
+        "float": pa.float64(),
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in DATASETS[dataset]])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain.
+
+    Tracks the absolute position so the Parquet footer offsets stay correct.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def parquet_stream(db, dataset: str, batch_size: int) -> AsyncIterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema(dataset)
+    columns = DATASETS[dataset]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    # Encoding and zstd compression are CPU-bound; keep them off the event loop
+    def write(batch: List[dict]) -> bytes:
+        writer.write_table(pa.Table.from_pylist([_encode_row(columns, doc) for doc in batch], schema=schema))
+        return sink.drain()
+
+    try:
+        async for batch in iter_batches(db, dataset, batch_size):
+            yield await run_in_threadpool(write, batch)
+    finally:
+        await run_in_threadpool(writer.close)
+    yield sink.drain()
+
+
+async def iter_ndjson_lines(upload, chunk_size: int = 1 << 20) -> AsyncIterator[Tuple[int, bytes]]:
+    """Yield ``(line_number, line)`` from an uploaded NDJSON file, reading it in chunks"""
+    pending = b""
+    line_number = 0
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if pending.strip():
+        yield line_number + 1, pending
+
+
+def iter_parquet(file, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Yield lists of rows from a Parquet file object (blocking)"""
+    import pyarrow.parquet as pq
+
+    for record_batch in pq.ParquetFile(file).iter_batches(batch_size=batch_size):
+        yield record_batch.to_pylist()
+
+
+class BulkImporter:
+    """Validates imported documents with ``models`` and upserts them by id in batches"""
+
+    def __init__(self, db, models: Dict[str, Any], batch_size: int, prepare: Callable[[dict], dict]):
+        self.db = db
+        self.models = models
+        self.batch_size = batch_size
+        self.prepare = prepare
+        # Per collection: (line/row number, document) waiting for the next write
+        self.pending: Dict[str, List[Tuple[int, dict]]] = {name: [] for name in models}
+        self.counts = {name: {"upserted": 0, "modified": 0} for name in models}
+        self.errors = []
+        self.error_count = 0
+        self.skipped = 0
+
+    async def add(self, collection: str, doc: dict, position: int):
+        if collection in DATASETS and collection not in self.models:
+            # Derived datasets such as exam_measurements are rebuilt from exams
+            self.skipped += 1
+            return
+        if collection not in self.models:
+            raise ValueError(f"Unknown collection: {collection}")
+        model = self.models[collection](**doc)
+        self.pending[collection].append((position, self.prepare(model.model_dump())))
+        if len(self.pending[collection]) >= self.batch_size:
+            await self.flush(collection)
+
+    def error(self, position: Optional[int], error: Any):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": position, "error": str(error)})
+
+    async def flush(self, collection: str):
+        pending = self.pending[collection]
+        if not pending:
+            return
+        self.pending[collection] = []
+        docs = [doc for _, doc in pending]
+        # Imported documents get fresh revisions so sync clients pick them up
+        now = datetime.now(timezone.utc)
+        failed = set()
+        async with revisions.reserve(self.db, len(docs)) as last:
+            operations = [
+                ReplaceOne({"id": doc["id"]}, {**doc, "revision": last - len(docs) + 1 + i, "updated_at": now}, upsert=True)
+                for i, doc in enumerate(docs)
+            ]
+            try:
+                result = await self.db[collection].bulk_write(operations, ordered=False)
+                upserted, modified = result.upserted_count, result.modified_count
+            except BulkWriteError as e:
+                # Unordered: the rest of the batch was written
+                details = e.details
+                upserted, modified = details.get("nUpserted", 0), details.get("nModified", 0)
+                for write_error in details.get("writeErrors", []):
+                    failed.add(write_error["index"])
+                    self.error(pending[write_error["index"]][0], write_error.get("errmsg"))
+                for concern_error in details.get("writeConcernErrors", []):
+                    self.error(None, concern_error.get("errmsg"))
+        ids = [doc["id"] for i, doc in enumerate(docs) if i not in failed]
+        # A re-imported document is live again, so sync must stop reporting it deleted
+        await self.db.tombstones.delete_many({"collection": collection, "id": {"$in": ids}})
+        if collection == "exams":
+            # An imported exam replaces any archived copy
+            await self.db.exams_archive.delete_many({"id": {"$in": ids}})
+        self.counts[collection]["upserted"] += upserted
+        self.counts[collection]["modified"] += modified
+
+    async def flush_all(self):
+        for collection in self.models:
+            await self.flush(collection)
+
+    def summary(self) -> dict:
+        return {
+            "collections": self.counts,
+            "skipped": self.skipped,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
@@ -0,0 +1,188 @@
+"""MongoDB connection: pool configuration from MONGO_* env vars, warm-up and pool statistics"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.read_preferences import _ServerMode, make_read_preference, read_pref_mode_from_name
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default=None):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def client_options() -> Dict[str, Any]:
+    """Build the Motor client keyword arguments from the environment"""
+    options = {
+        # Datetimes are stored as native BSON dates and decoded as tz-aware UTC
+        "tz_aware": True,
+        "tzinfo": timezone.utc,
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 10),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS", 10000),
+    }
+    optional = {
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS"),
+        "socketTimeoutMS": _env_int("MONGO_SOCKET_TIMEOUT_MS"),
+        "compressors": os.environ.get("MONGO_COMPRESSORS") or None,
+        "zlibCompressionLevel": _env_int("MONGO_ZLIB_COMPRESSION_LEVEL"),
+    }
+    options.update({key: value for key, value in optional.items() if value is not None})
+    return options
+
+
+def list_read_preference() -> _ServerMode:
+    """Read preference for the read-only list endpoints; everything else reads the primary"""
+    mode = read_pref_mode_from_name(os.environ.get("MONGO_READ_PREFERENCE", "primary"))
+    return make_read_preference(mode, None)
+
+
+class PoolStatistics(monitoring.ConnectionPoolListener):
+    """Connection pool event counters, aggregated over every server in the topology"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _increment(self, counter: str):
+        # Pool events are published from driver threads
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._increment("pool_clears")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._increment("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._increment("closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._increment("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._increment("checked_out")
+
+    def connection_checked_in(self, event):
+        self._increment("checked_in")
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "in_use": self.checked_out - self.checked_in,
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "checkouts": self.checked_out,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+            }
+
+
+class _DatabaseProxy:
+    """Module-level handle that forwards to the database opened by connect()"""
+
+    def _database(self):
+        if _database is None:
+            raise RuntimeError("MongoDB is not connected; connect() runs in the app lifespan")
+        return _database
+
+    def __getattr__(self, name: str):
+        return getattr(self._database(), name)
+
+    def __getitem__(self, name: str):
+        return self._database()[name]
+
+
+pool_statistics = PoolStatistics()
+options: Dict[str, Any] = {}
+client: Optional[AsyncIOMotorClient] = None
+_database = None
+db = _DatabaseProxy()
+
+
+def connect():
+    """Create the Motor client; the driver opens connections in the background"""
+    global client, _database, options
+    options = client_options()
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        event_listeners=[pool_statistics],
+        **options
+    )
+    _database = client[os.environ['DB_NAME']]
+
+
+def close():
+    global client, _database
+    if client is not None:
+        client.close()
+    client = None
+    _database = None
+
+
+async def warm_up_pool():
+    """Verify the server is reachable and open minPoolSize connections up front"""
+    start = time.perf_counter()
+    await db.command("ping")
+    min_pool_size = client.options.pool_options.min_pool_size
+    if min_pool_size > 1:
+        # Concurrent pings force the pool to open that many connections now
+        await asyncio.gather(*(db.command("ping") for _ in range(min_pool_size)))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(
+        f"MongoDB pool warmed in {elapsed_ms:.1f} ms "
+        f"({pool_statistics.snapshot()['open_connections']} connections open)"
+    )
+
+
+async def health() -> Dict[str, Any]:
+    """Ping the server and report latency together with pool statistics"""
+    start = time.perf_counter()
+    await db.command("ping")
+    return {
+        "ping_ms": round((time.perf_counter() - start) * 1000, 2),
+        "pool": pool_statistics.snapshot(),
+        "config": {
+            **{key: value for key, value in options.items() if key not in ("tz_aware", "tzinfo")},
+            "listReadPreference": list_read_preference().name,
+        },
+    }
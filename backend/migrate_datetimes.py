@@ -0,0 +1,107 @@
+"""One-shot migration of ISO-string timestamps to native BSON dates.
+
+Older versions of server.py stored every datetime as an ISO string. This
+script walks each affected collection with a cursor, converting only the
+documents that still hold strings, and applies the updates in unordered bulk
+batches so it never loads a whole collection into memory. It is safe to run
+again: converted fields no longer match the ``$type: "string"`` filter.
+
+Run from the backend directory:
+
+    python migrate_datetimes.py [--batch-size 500] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger("migrate_datetimes")
+
+# Collection -> datetime fields written as strings by older versions
+DATETIME_FIELDS = {
+    "patients": ["created_at"],
+    "exams": ["exam_date", "created_at"],
+    "license_codes": ["used_at", "expires_at"],
+    "licenses": ["used_at", "expires_at"],
+}
+
+
+def parse_iso(value: str) -> datetime:
+    """Parse an ISO timestamp, treating naive values as UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+async def migrate_field(collection, field: str, batch_size: int, dry_run: bool) -> int:
+    """Convert one field of one collection, returning the number of documents updated"""
+    cursor = collection.find(
+        {field: {"$type": "string"}},
+        {"_id": 1, field: 1}
+    ).batch_size(batch_size)
+
+    converted = 0
+    operations = []
+    async for doc in cursor:
+        raw = doc[field]
+        try:
+            value = parse_iso(raw)
+        except ValueError:
+            logger.warning(f"{collection.name}.{field}: skipping unparseable value {raw!r} ({doc['_id']})")
+            continue
+        # Match on the old value too, so a concurrent write is never overwritten
+        operations.append(UpdateOne({"_id": doc["_id"], field: raw}, {"$set": {field: value}}))
+        if len(operations) >= batch_size:
+            converted += await flush(collection, operations, dry_run)
+            operations = []
+
+    if operations:
+        converted += await flush(collection, operations, dry_run)
+    return converted
+
+
+async def flush(collection, operations: list, dry_run: bool) -> int:
+    if dry_run:
+        return len(operations)
+    result = await collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+async def migrate(batch_size: int, dry_run: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True, tzinfo=timezone.utc)
+    db = client[os.environ['DB_NAME']]
+    try:
+        for collection_name, fields in DATETIME_FIELDS.items():
+            for field in fields:
+                converted = await migrate_field(db[collection_name], field, batch_size, dry_run)
+                action = "would convert" if dry_run else "converted"
+                logger.info(f"{collection_name}.{field}: {action} {converted} documents")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to native BSON dates")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="count documents without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(migrate(args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
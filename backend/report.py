@@ -0,0 +1,377 @@
+"""DOCX report rendering.
+
+Kept out of server.py so python-docx is only imported on the first export
+rather than at worker boot.
+"""
+import copy
+import io
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import orjson
+from docx import Document
+from docx.shared import Pt, Inches
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+
+# A rendered organ paragraph: (text, bold, italic) per run, None meaning unset
+OrganFragment = Tuple[Tuple[str, Optional[bool], Optional[bool]], ...]
+
+# The <w:p> elements of an organ section: heading, report paragraph, spacer
+OrganSection = List
+
+OrganSectionKey = Tuple[Optional[str], bytes]
+
+
+class OrganFragmentCache:
+    """Thread-safe LRU of rendered organ sections, shared by all exports.
+
+    Entries are the paragraph XML python-docx produced for a section, so a
+    re-export after editing one organ only builds that organ's paragraphs;
+    the others are copied in. Elements are deep-copied on the way in and out,
+    under the lock, so no lxml tree is shared between exports.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[OrganSectionKey, OrganSection]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: OrganSectionKey) -> Optional[OrganSection]:
+        with self._lock:
+            section = self._entries.get(key)
+            if section is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [copy.deepcopy(element) for element in section]
+
+    def put(self, key: OrganSectionKey, section: OrganSection):
+        section = [copy.deepcopy(element) for element in section]
+        with self._lock:
+            self._entries[key] = section
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def hit_ratio(self) -> float:
+        with self._lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+organ_fragment_cache = OrganFragmentCache(int(os.environ.get("ORGAN_FRAGMENT_CACHE_SIZE", "2048")))
+
+
+def heading_style_id(doc, level: int) -> Optional[str]:
+    """Style id used by ``doc.add_heading(level=...)``, None when the template lacks it"""
+    try:
+        return doc.styles[f"Heading {level}"].style_id
+    except KeyError:
+        return None
+
+
+def body_content_end(doc) -> int:
+    """Index in <w:body> where python-docx appends the next paragraph (before <w:sectPr>)"""
+    body = doc.element.body
+    return len(body) - (1 if body.sectPr is not None else 0)
+
+
+def organ_fragment_key(organ_data: dict, heading_style: Optional[str]) -> OrganSectionKey:
+    """Everything an organ section's XML is built from"""
+    # Key order is kept: measurements are rendered in insertion order
+    return heading_style, orjson.dumps(organ_data, default=str)
+
+
+def render_organ_fragment(organ_data: dict) -> OrganFragment:
+    """Build the runs of an organ's report paragraph (empty when there is none)"""
+    # Generate humanized text with measurements
+    measurements = organ_data.get('measurements', {})
+    report_text = organ_data.get('report_text', '')
+    
+    # Format measurements string
+    measurements_str = ""
+    if measurements:
+        measurement_values = list(measurements.values())
+        organ_name = organ_data['organ_name']
+        
+        # Check if it's adrenal (special format)
+        if 'Adrenal' in organ_name:
+            if len(measurement_values) >= 3:
+                measurements_str = f"{measurement_values[0]['value']}x{measurement_values[1]['value']}x{measurement_values[2]['value']} cm"
+            else:
+                measurements_str = ' x '.join([f"{m['value']}" for m in measurement_values]) + " cm"
+        elif len(measurement_values) == 1:
+            measurements_str = f"{measurement_values[0]['value']} cm"
+        else:
+            measurements_str = ' x '.join([f"{m['value']}" for m in measurement_values]) + " cm"
+    
+    # Process report text with {MEDIDA} placeholder and formatting
+    if report_text:
+        # Replace {MEDIDA} with actual measurements
+        if '{MEDIDA}' in report_text and measurements_str:
+            processed_text = report_text.replace('{MEDIDA}', f"medindo aproximadamente {measurements_str}")
+        else:
+            # If no {MEDIDA} but has measurements, add at start
+            if measurements_str:
+                processed_text = f"{organ_data['organ_name']} medindo aproximadamente {measurements_str}, {report_text}"
+            else:
+                processed_text = f"{organ_data['organ_name']} {report_text}"
+        
+        # Process markdown-style formatting
+        runs = []
+        # Split by bold (**text**)
+        parts = re.split(r'(\*\*.*?\*\*)', processed_text)
+        for part in parts:
+            if part.startswith('**') and part.endswith('**'):
+                # Bold text
+                runs.append((part[2:-2], True, None))
+            else:
+                # Check for italic (*text*)
+                italic_parts = re.split(r'(\*.*?\*)', part)
+                for ipart in italic_parts:
+                    if ipart.startswith('*') and ipart.endswith('*') and not ipart.startswith('**'):
+                        runs.append((ipart[1:-1], None, True))
+                    elif ipart:
+                        runs.append((ipart, None, None))
+        return tuple(runs)
+    elif measurements_str:
+        # Only measurements, no report text
+        return ((f"{organ_data['organ_name']} medindo aproximadamente {measurements_str}.", None, None),)
+    return ()
+
+
+def render_exam_report(exam: dict, patient: dict, settings: Optional[dict],
+                       load_blob: Callable[[str], Optional[bytes]]) -> bytes:
+    """Render the exam report as a DOCX package held entirely in memory.
+
+    ``load_blob`` reads the letterhead and images from blob storage by key.
+    """
+    # Create document - use letterhead template if available
+    letterhead_path = settings.get("letterhead_path") if settings else None
+    letterhead = load_blob(letterhead_path) if letterhead_path else None
+    
+    if letterhead is not None:
+        # Use the uploaded letterhead as template
+        # The letterhead has header/footer, and empty body - perfect for inserting laudo
+        try:
+            doc = Document(io.BytesIO(letterhead))
+            logging.info(f"Using letterhead template: {letterhead_path}")
+            # Clear any existing content in body (should be empty already)
+            for para in doc.paragraphs[:]:
+                para.clear()
+        except Exception as e:
+            logging.error(f"Error loading letterhead: {e}")
+            doc = Document()
+            # Fallback to text-based header
+            if settings and settings.get("clinic_name"):
+                heading = doc.add_heading(settings["clinic_name"], level=1)
+                heading.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                if settings.get("clinic_address"):
+                    addr = doc.add_paragraph(settings["clinic_address"])
+                    addr.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                if settings.get("veterinarian_name") or settings.get("crmv"):
+                    vet_info = f"{settings.get('veterinarian_name', '')} - CRMV: {settings.get('crmv', '')}"
+                    vet_para = doc.add_paragraph(vet_info)
+                    vet_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                doc.add_paragraph()
+    else:
+        # No letterhead file, create new document with text header
+        doc = Document()
+        if settings and settings.get("clinic_name"):
+            heading = doc.add_heading(settings["clinic_name"], level=1)
+            heading.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            
+            if settings.get("clinic_address"):
+                addr = doc.add_paragraph(settings["clinic_address"])
+                addr.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            
+            if settings.get("veterinarian_name") or settings.get("crmv"):
+                vet_info = f"{settings.get('veterinarian_name', '')} - CRMV: {settings.get('crmv', '')}"
+                vet_para = doc.add_paragraph(vet_info)
+                vet_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            
+            doc.add_paragraph()  # Spacer
+    
+    # Add title
+    try:
+        title = doc.add_heading('LAUDO DE ULTRASSONOGRAFIA ABDOMINAL', level=1)
+        title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    except KeyError:
+        para = doc.add_paragraph('LAUDO DE ULTRASSONOGRAFIA ABDOMINAL')
+        run = para.runs[0]
+        run.bold = True
+        run.font.size = Pt(16)
+        para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    
+    doc.add_paragraph()
+    
+    # Patient information
+    try:
+        doc.add_heading('Dados do Paciente', level=2)
+    except KeyError:
+        para = doc.add_paragraph('Dados do Paciente')
+        run = para.runs[0]
+        run.bold = True
+        run.font.size = Pt(14)
+        para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+    para = doc.add_paragraph(f"Nome: {patient['name']}")
+    para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+    para = doc.add_paragraph(f"Espécie: {'Canino' if patient['species'] == 'dog' else 'Felino'}")
+    para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+    para = doc.add_paragraph(f"Raça: {patient['breed']}")
+    para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+    
+    # Use exam weight if available, otherwise use patient weight
+    weight = exam.get('exam_weight') or patient['weight']
+    doc.add_paragraph(f"Peso: {weight} kg")
+    
+    doc.add_paragraph(f"Porte: {patient['size'].capitalize()}")
+    doc.add_paragraph(f"Sexo: {'Macho' if patient['sex'] == 'male' else 'Fêmea'}")
+    if patient.get('is_neutered'):
+        doc.add_paragraph("Paciente Castrado")
+    if patient.get('owner_name'):
+        doc.add_paragraph(f"Tutor: {patient['owner_name']}")
+    
+    exam_date = exam.get('exam_date')
+    doc.add_paragraph(f"Data do Exame: {exam_date.strftime('%d/%m/%Y')}")
+    doc.add_paragraph()
+    
+    # Organ findings with humanized text
+    try:
+        doc.add_heading('Achados Ultrassonográficos', level=2)
+    except KeyError:
+        # Timbrado template may not have Heading styles
+        para = doc.add_paragraph('Achados Ultrassonográficos')
+        run = para.runs[0]
+        run.bold = True
+        run.font.size = Pt(14)
+        para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+    
+    organs_data = exam.get('organs_data', [])
+    heading_style = heading_style_id(doc, 3) if organs_data else None
+    hits = misses = 0
+    for organ_data in organs_data:
+        if organ_data.get('report_text') or organ_data.get('measurements'):
+            key = organ_fragment_key(organ_data, heading_style)
+            section = organ_fragment_cache.get(key)
+            if section is not None:
+                hits += 1
+                for element in section:
+                    doc.element.body._insert_p(element)
+                continue
+            
+            misses += 1
+            start = body_content_end(doc)
+            # Try to add heading, fallback to bold paragraph if style doesn't exist
+            try:
+                doc.add_heading(organ_data['organ_name'], level=3)
+            except KeyError:
+                para = doc.add_paragraph(organ_data['organ_name'])
+                run = para.runs[0]
+                run.bold = True
+                run.font.size = Pt(12)
+                para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+            
+            fragment = render_organ_fragment(organ_data)
+            if fragment:
+                para = doc.add_paragraph()
+                para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+                for text, bold, italic in fragment:
+                    run = para.add_run(text)
+                    if bold is not None:
+                        run.bold = bold
+                    if italic is not None:
+                        run.italic = italic
+            
+            doc.add_paragraph()
+            # Everything the section appended, including what a failed add_heading leaves behind
+            organ_fragment_cache.put(key, list(doc.element.body)[start:body_content_end(doc)])
+    
+    if hits or misses:
+        logging.info(
+            f"Organ fragments: {hits} reused, {misses} rendered "
+            f"(cache hit ratio {organ_fragment_cache.hit_ratio():.0%} since start, "
+            f"{len(organ_fragment_cache)} entries)"
+        )
+    
+    # Add images in 2 columns at the end
+    images = exam.get('images', [])
+    if images:
+        doc.add_page_break()
+        
+        # Add title
+        try:
+            title_para = doc.add_heading('Imagens do Exame', level=2)
+            title_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        except KeyError:
+            para = doc.add_paragraph('Imagens do Exame')
+            run = para.runs[0]
+            run.bold = True
+            run.font.size = Pt(14)
+            para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        
+        # Add table for 2-column layout
+        image_count = 0
+        for i in range(0, len(images), 6):  # Process 6 images at a time
+            # Add spacing before table if not first
+            if i > 0:
+                doc.add_paragraph()
+            
+            # Create table: 3 rows x 2 columns for images
+            table = doc.add_table(rows=3, cols=2)
+            table.autofit = False
+            table.allow_autofit = False
+            
+            # Set column widths (make them equal)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.width = Inches(3.2)
+            
+            batch = images[i:i+6]
+            for idx, img in enumerate(batch):
+                try:
+                    image_data = load_blob(img['path'])
+                    if image_data is not None:
+                        row_idx = idx // 2
+                        col_idx = idx % 2
+                        cell = table.rows[row_idx].cells[col_idx]
+                        
+                        # Add image to cell with better sizing
+                        paragraph = cell.paragraphs[0]
+                        paragraph.clear()  # Clear any default content
+                        run = paragraph.add_run()
+                        
+                        # Use slightly smaller image size for better fit
+                        run.add_picture(io.BytesIO(image_data), width=Inches(2.5))
+                        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                        
+                        # Add caption
+                        if img.get('organ'):
+                            caption_para = cell.add_paragraph(img['organ'])
+                            caption_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                            for run in caption_para.runs:
+                                run.font.size = Pt(8)
+                                run.font.italic = True
+                        
+                        image_count += 1
+                except Exception as e:
+                    logging.error(f"Error adding image to document: {e}")
+            
+            # Add page break after 6 images if there are more
+            if i + 6 < len(images):
+                doc.add_page_break()
+    
+    # Save document into an in-memory buffer
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,77 @@
+"""Global revision counter for delta sync, with leases that hold back the sync watermark"""
+import os
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+from pymongo import ReadPreference, ReturnDocument
+
+SYNC_LEASE_SECONDS = int(os.environ.get("SYNC_LEASE_SECONDS", "60"))
+
+# Highest counter value this process has seen; a lower bound for any new reservation
+_last_seen = 0
+
+
+def _counters(db):
+    # The watermark is only safe on current data, whatever the client default
+    return db.get_collection("counters", read_preference=ReadPreference.PRIMARY)
+
+
+def _leases(db):
+    return db.get_collection("revision_leases", read_preference=ReadPreference.PRIMARY)
+
+
+def _observe(value: int):
+    global _last_seen
+    _last_seen = max(_last_seen, value)
+
+
+async def ensure_indexes(db):
+    await _leases(db).create_index("expires_at", expireAfterSeconds=0)
+    await _leases(db).create_index("floor")
+
+
+async def current(db) -> int:
+    counter = await _counters(db).find_one({"_id": "revision"})
+    value = counter["value"] if counter else 0
+    _observe(value)
+    return value
+
+
+@asynccontextmanager
+async def reserve(db, count: int = 1) -> AsyncIterator[int]:
+    """Reserve ``count`` revisions, yielding the highest; write inside the block"""
+    # The lease keeps sync's watermark below these revisions until the block exits
+    now = datetime.now(timezone.utc)
+    lease_id = uuid.uuid4().hex
+    await _leases(db).insert_one({
+        "_id": lease_id,
+        "floor": _last_seen,
+        "expires_at": now + timedelta(seconds=SYNC_LEASE_SECONDS),
+    })
+    try:
+        counter = await _counters(db).find_one_and_update(
+            {"_id": "revision"},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        _observe(counter["value"])
+        yield counter["value"]
+    finally:
+        await _leases(db).delete_one({"_id": lease_id})
+
+
+async def stable_revision(db) -> int:
+    """Highest revision below which every write has committed"""
+    # Counter first: a writer missing from the lease read has either
+    # committed already or reserves a revision above this value
+    stable = await current(db)
+    lease = await _leases(db).find_one(
+        {"expires_at": {"$gt": datetime.now(timezone.utc)}},
+        sort=[("floor", 1)]
+    )
+    if lease is not None:
+        stable = min(stable, lease["floor"])
+    return stable
@@ -1,46 +1,68 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Query
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
+from pymongo import UpdateOne
+import orjson
 import uuid
 from datetime import datetime, timezone
-from docx import Document
-from docx.shared import Pt, RGBColor, Inches
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+import asyncio
 import base64
+import hashlib
 import io
-from PIL import Image
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
+import archive
+import bulk
+import database
+import revisions
+from database import db
+from storage import RENDITION_WIDTHS, BlobNotFound, get_storage, key_from_path, rendition_key
+from singleflight import SingleFlight
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connections and upload directories are set up here, not at import time
+    database.connect()
+    get_storage()
+    try:
+        await database.warm_up_pool()
+    except Exception as e:
+        # Keep booting; the driver reconnects once the server is reachable
+        logger.error(f"MongoDB pool warm-up failed: {e}")
+    startup = asyncio.create_task(run_startup_tasks())
+    yield
+    startup.cancel()
+    database.close()
+    shutdown_image_pool()
+
+class UTCJSONResponse(ORJSONResponse):
+    """ORJSONResponse that writes UTC datetimes with a "Z" suffix, as Pydantic models do"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z
+        )
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=UTCJSONResponse, lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Ensure upload directories exist
-UPLOAD_DIR = ROOT_DIR / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
-IMAGES_DIR = UPLOAD_DIR / "images"
-IMAGES_DIR.mkdir(exist_ok=True)
-REPORTS_DIR = UPLOAD_DIR / "reports"
-REPORTS_DIR.mkdir(exist_ok=True)
-LETTERHEAD_DIR = UPLOAD_DIR / "letterheads"
-LETTERHEAD_DIR.mkdir(exist_ok=True)
-
 # Models
 class Patient(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -82,7 +104,7 @@ class ExamImage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     filename: str
     organ: Optional[str] = None
-    path: str
+    path: str  # Storage key, e.g. "images/<id>.jpg" (older records hold absolute paths)
 
 class Exam(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -150,7 +172,7 @@ class Settings(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
     id: str = "global_settings"
-    letterhead_path: Optional[str] = None
+    letterhead_path: Optional[str] = None  # Storage key of the letterhead template
     letterhead_text_area: Optional[Dict[str, float]] = None  # {x, y, width, height}
     clinic_name: Optional[str] = None
     clinic_address: Optional[str] = None
@@ -174,11 +196,22 @@ class LicenseStatus(BaseModel):
     is_open_license: bool  # True when all 200 codes are consumed
 
 # Helper functions
+# Fields that older records may still hold as ISO strings (see migrate_datetimes.py)
+DATETIME_FIELDS = ('created_at', 'exam_date', 'used_at', 'expires_at')
+
+def as_utc(value: datetime) -> datetime:
+    """Make a datetime tz-aware, treating naive values as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
 def prepare_for_mongo(data: dict) -> dict:
-    """Convert datetime objects to ISO strings for MongoDB storage"""
+    """Normalize datetime objects to UTC so they are stored as native BSON dates"""
     for key, value in data.items():
         if isinstance(value, datetime):
-            data[key] = value.isoformat()
+            data[key] = as_utc(value)
+        elif isinstance(value, dict):
+            prepare_for_mongo(value)
         elif isinstance(value, list):
             for i, item in enumerate(value):
                 if isinstance(item, dict):
@@ -186,39 +219,193 @@ def prepare_for_mongo(data: dict) -> dict:
     return data
 
 def parse_from_mongo(item: dict) -> dict:
-    """Convert ISO string timestamps back to datetime objects"""
+    """Decode timestamps still stored as ISO strings by older versions"""
     if item is None:
         return None
-    for key, value in item.items():
-        if key in ['created_at', 'exam_date'] and isinstance(value, str):
-            item[key] = datetime.fromisoformat(value)
+    for key in DATETIME_FIELDS:
+        value = item.get(key)
+        if isinstance(value, str):
+            item[key] = as_utc(datetime.fromisoformat(value))
     return item
 
+# Delta sync: every write to a synced collection stamps a global revision
+SYNC_COLLECTIONS = ("patients", "exams", "templates", "reference_values")
+SYNC_MAX_BATCH = 2000
+
+@asynccontextmanager
+async def revision_fields():
+    """Fields to $set on every create/update of a synced document.
+
+    The write must happen inside the block, see revisions.py.
+    """
+    async with revisions.reserve(db) as revision:
+        yield {"revision": revision, "updated_at": datetime.now(timezone.utc)}
+
+async def record_deletion(collection: str, doc_id: str):
+    """Leave a tombstone so sync clients learn about the deletion"""
+    now = datetime.now(timezone.utc)
+    async with revisions.reserve(db) as revision:
+        await db.tombstones.update_one(
+            {"collection": collection, "id": doc_id},
+            {"$set": {"revision": revision, "deleted_at": now}},
+            upsert=True
+        )
+
+async def insert_stamped(collection: str, docs: List[dict]):
+    """Insert new synced documents with consecutive revisions from a single reservation"""
+    now = datetime.now(timezone.utc)
+    async with revisions.reserve(db, len(docs)) as last:
+        for i, doc in enumerate(docs):
+            doc.update(revision=last - len(docs) + 1 + i, updated_at=now)
+        await db[collection].insert_many(docs)
+
+async def ensure_sync_revisions(batch_size: int = 500):
+    """Create the sync indexes and stamp documents written before revisions existed"""
+    for name in SYNC_COLLECTIONS:
+        await db[name].create_index("revision")
+        # Lookups and bulk upserts go by id
+        await db[name].create_index("id")
+    await db.tombstones.create_index("revision")
+    await db.tombstones.create_index([("collection", 1), ("id", 1)], unique=True)
+    await revisions.ensure_indexes(db)
+    
+    for name in SYNC_COLLECTIONS:
+        cursor = db[name].find({"revision": {"$exists": False}}, {"_id": 1}).batch_size(batch_size)
+        ids = []
+        async for doc in cursor:
+            ids.append(doc["_id"])
+            if len(ids) >= batch_size:
+                await _stamp_revisions(name, ids)
+                ids = []
+        if ids:
+            await _stamp_revisions(name, ids)
+
+_sync_setup: Optional[asyncio.Task] = None
+
+async def ensure_sync_ready():
+    """Run ensure_sync_revisions once per worker, again if the last attempt failed"""
+    global _sync_setup
+    if _sync_setup is None or (_sync_setup.done() and (_sync_setup.cancelled() or _sync_setup.exception())):
+        _sync_setup = asyncio.ensure_future(ensure_sync_revisions())
+    await asyncio.shield(_sync_setup)
+
+STARTUP_RETRY_MAX_DELAY = 60
+
+async def run_startup_tasks():
+    """Index setup and revision backfill, retried in the background until MongoDB answers"""
+    delay = 1
+    while True:
+        try:
+            await ensure_sync_ready()
+            await archive.ensure_indexes(db)
+            return
+        except Exception as e:
+            logger.error(f"MongoDB startup tasks failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
+async def _stamp_revisions(collection: str, ids: list):
+    now = datetime.now(timezone.utc)
+    async with revisions.reserve(db, len(ids)) as last:
+        operations = [
+            # Another worker may have stamped the document meanwhile; keep its revision
+            UpdateOne({"_id": _id, "revision": {"$exists": False}},
+                      {"$set": {"revision": last - len(ids) + 1 + i, "updated_at": now}})
+            for i, _id in enumerate(ids)
+        ]
+        await db[collection].bulk_write(operations, ordered=False)
+
+# Concurrent identical exports and image reads share one in-progress computation
+export_flight = SingleFlight("export")
+image_flight = SingleFlight("image")
+
+def content_version(*docs: Optional[dict]) -> str:
+    """Digest of the documents a rendered artifact is built from"""
+    return hashlib.sha256(orjson.dumps(docs, option=orjson.OPT_SORT_KEYS)).hexdigest()[:16]
+
+# Archived exams (see archive.py) stay readable through these lookups
+async def find_exam(exam_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+    """Exam by id from the hot collection, falling through to the archive"""
+    projection = projection or {"_id": 0}
+    exam = await db.exams.find_one({"id": exam_id}, projection)
+    if exam is None:
+        exam = await archive.find_archived(db, {"id": exam_id})
+        if exam is not None:
+            exam = apply_projection(exam, projection)
+    return exam
+
+async def find_exam_by_image(image_id: str) -> Optional[dict]:
+    exam = await db.exams.find_one({"images.id": image_id}, {"_id": 0})
+    if exam is None:
+        exam = await archive.find_archived(db, {"image_ids": image_id})
+    return exam
+
+async def ensure_hot_exam(exam_id: str) -> bool:
+    """Check an exam exists before writing to it, restoring it from the archive if needed"""
+    if await db.exams.find_one({"id": exam_id}, {"_id": 1}):
+        return True
+    return await archive.restore_exam(db, exam_id) is not None
+
+def apply_projection(doc: dict, projection: dict) -> dict:
+    """Apply an inclusion projection to a document decoded in Python"""
+    if not any(value == 1 for value in projection.values()):
+        return {key: value for key, value in doc.items() if projection.get(key, 1) != 0}
+    return {key: value for key, value in doc.items() if projection.get(key) == 1}
+
+def exam_date_key(exam: dict) -> datetime:
+    return parse_from_mongo({"exam_date": exam.get("exam_date")})["exam_date"]
+
+def load_blob(path: str) -> Optional[bytes]:
+    """Read a stored file by key (or legacy absolute path), None if it is missing"""
+    try:
+        return get_storage().get(key_from_path(path))
+    except (BlobNotFound, ValueError):
+        return None
+
+def listing(name: str):
+    """Collection handle for the read-only list endpoints (MONGO_READ_PREFERENCE)"""
+    return db.get_collection(name, read_preference=database.list_read_preference())
+
+def projection_for(model: type[BaseModel]) -> dict:
+    """Mongo projection limited to the fields exposed by a response model"""
+    projection = {name: 1 for name in model.model_fields}
+    projection["_id"] = 0
+    return projection
+
+def trusted_response(data: Any) -> UTCJSONResponse:
+    """Serialize documents read from Mongo without re-validating them"""
+    # Validated on write; a Response also skips response_model, which stays for OpenAPI
+    return UTCJSONResponse(data)
+
 # Patient endpoints
 @api_router.post("/patients", response_model=Patient)
 async def create_patient(patient_data: PatientCreate):
     patient = Patient(**patient_data.model_dump())
     doc = prepare_for_mongo(patient.model_dump())
-    await db.patients.insert_one(doc)
+    async with revision_fields() as fields:
+        doc.update(fields)
+        await db.patients.insert_one(doc)
     return patient
 
 @api_router.get("/patients", response_model=List[Patient])
 async def get_patients():
-    patients = await db.patients.find({}, {"_id": 0}).to_list(1000)
-    return [Patient(**parse_from_mongo(p)) for p in patients]
+    patients = await listing("patients").find({}, projection_for(Patient)).to_list(1000)
+    return trusted_response(patients)
 
 @api_router.get("/patients/{patient_id}", response_model=Patient)
 async def get_patient(patient_id: str):
-    patient = await db.patients.find_one({"id": patient_id}, {"_id": 0})
+    patient = await db.patients.find_one({"id": patient_id}, projection_for(Patient))
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return Patient(**parse_from_mongo(patient))
+    return trusted_response(patient)
 
 @api_router.put("/patients/{patient_id}", response_model=Patient)
 async def update_patient(patient_id: str, patient_data: PatientCreate):
     patient = Patient(id=patient_id, **patient_data.model_dump())
     doc = prepare_for_mongo(patient.model_dump())
-    result = await db.patients.update_one({"id": patient_id}, {"$set": doc})
+    async with revision_fields() as fields:
+        doc.update(fields)
+        result = await db.patients.update_one({"id": patient_id}, {"$set": doc})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Patient not found")
     return patient
@@ -228,6 +415,7 @@ async def delete_patient(patient_id: str):
     result = await db.patients.delete_one({"id": patient_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Patient not found")
+    await record_deletion("patients", patient_id)
     return {"message": "Patient deleted successfully"}
 
 # Exam endpoints
@@ -238,39 +426,56 @@ async def create_exam(exam_data: ExamCreate):
         exam_dict['exam_date'] = datetime.now(timezone.utc)
     exam = Exam(**exam_dict)
     doc = prepare_for_mongo(exam.model_dump())
-    await db.exams.insert_one(doc)
+    async with revision_fields() as fields:
+        doc.update(fields)
+        await db.exams.insert_one(doc)
     return exam
 
 @api_router.get("/exams", response_model=List[Exam])
-async def get_exams(patient_id: Optional[str] = None):
+async def get_exams(patient_id: Optional[str] = None, include_archived: bool = False):
     query = {"patient_id": patient_id} if patient_id else {}
-    exams = await db.exams.find(query, {"_id": 0}).sort("exam_date", -1).to_list(1000)
-    return [Exam(**parse_from_mongo(e)) for e in exams]
+    exams = await listing("exams").find(query, projection_for(Exam)).sort("exam_date", -1).to_list(1000)
+    if include_archived:
+        records = await listing("exams_archive").find(query, {"payload": 1}).sort("exam_date", -1).to_list(1000)
+        exams.extend(apply_projection(archive.decompress_exam(r), projection_for(Exam)) for r in records)
+        exams.sort(key=exam_date_key, reverse=True)
+        del exams[1000:]
+    return trusted_response(exams)
 
 @api_router.get("/exams/{exam_id}", response_model=Exam)
 async def get_exam(exam_id: str):
-    exam = await db.exams.find_one({"id": exam_id}, {"_id": 0})
+    exam = await find_exam(exam_id, projection_for(Exam))
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
-    return Exam(**parse_from_mongo(exam))
+    return trusted_response(exam)
 
 @api_router.put("/exams/{exam_id}", response_model=Exam)
 async def update_exam(exam_id: str, exam_data: ExamUpdate):
     update_dict = {k: v for k, v in exam_data.model_dump().items() if v is not None}
     if update_dict:
         update_dict = prepare_for_mongo(update_dict)
-        result = await db.exams.update_one({"id": exam_id}, {"$set": update_dict})
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Exam not found")
+        async with revision_fields() as fields:
+            update_dict.update(fields)
+            result = await db.exams.update_one({"id": exam_id}, {"$set": update_dict})
+            if result.matched_count == 0:
+                # Editing an archived exam brings it back to the hot collection
+                if await archive.restore_exam(db, exam_id) is None:
+                    raise HTTPException(status_code=404, detail="Exam not found")
+                await db.exams.update_one({"id": exam_id}, {"$set": update_dict})
     
-    exam = await db.exams.find_one({"id": exam_id}, {"_id": 0})
-    return Exam(**parse_from_mongo(exam))
+    exam = await find_exam(exam_id, projection_for(Exam))
+    if not exam:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    return trusted_response(exam)
 
 @api_router.delete("/exams/{exam_id}")
 async def delete_exam(exam_id: str):
     result = await db.exams.delete_one({"id": exam_id})
+    if result.deleted_count == 0:
+        result = await db.exams_archive.delete_one({"id": exam_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Exam not found")
+    await record_deletion("exams", exam_id)
     return {"message": "Exam deleted successfully"}
 
 # Template text endpoints
@@ -278,20 +483,24 @@ async def delete_exam(exam_id: str):
 async def create_template(template_data: TemplateTextCreate):
     template = TemplateText(**template_data.model_dump())
     doc = template.model_dump()
-    await db.templates.insert_one(doc)
+    async with revision_fields() as fields:
+        doc.update(fields)
+        await db.templates.insert_one(doc)
     return template
 
 @api_router.get("/templates", response_model=List[TemplateText])
 async def get_templates(organ: Optional[str] = None):
     query = {"organ": organ} if organ else {}
-    templates = await db.templates.find(query, {"_id": 0}).sort("order", 1).to_list(1000)
-    return [TemplateText(**t) for t in templates]
+    templates = await listing("templates").find(query, projection_for(TemplateText)).sort("order", 1).to_list(1000)
+    return trusted_response(templates)
 
 @api_router.put("/templates/{template_id}", response_model=TemplateText)
 async def update_template(template_id: str, template_data: TemplateTextCreate):
     template = TemplateText(id=template_id, **template_data.model_dump())
     doc = template.model_dump()
-    result = await db.templates.update_one({"id": template_id}, {"$set": doc})
+    async with revision_fields() as fields:
+        doc.update(fields)
+        result = await db.templates.update_one({"id": template_id}, {"$set": doc})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Template not found")
     return template
@@ -301,6 +510,7 @@ async def delete_template(template_id: str):
     result = await db.templates.delete_one({"id": template_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Template not found")
+    await record_deletion("templates", template_id)
     return {"message": "Template deleted successfully"}
 
 # Reference values endpoints
@@ -308,7 +518,9 @@ async def delete_template(template_id: str):
 async def create_reference_value(ref_data: ReferenceValueCreate):
     ref_value = ReferenceValue(**ref_data.model_dump())
     doc = ref_value.model_dump()
-    await db.reference_values.insert_one(doc)
+    async with revision_fields() as fields:
+        doc.update(fields)
+        await db.reference_values.insert_one(doc)
     return ref_value
 
 @api_router.get("/reference-values", response_model=List[ReferenceValue])
@@ -325,14 +537,16 @@ async def get_reference_values(
     if size:
         query["size"] = size
     
-    ref_values = await db.reference_values.find(query, {"_id": 0}).to_list(1000)
-    return [ReferenceValue(**r) for r in ref_values]
+    ref_values = await listing("reference_values").find(query, projection_for(ReferenceValue)).to_list(1000)
+    return trusted_response(ref_values)
 
 @api_router.put("/reference-values/{ref_id}", response_model=ReferenceValue)
 async def update_reference_value(ref_id: str, ref_data: ReferenceValueCreate):
     ref_value = ReferenceValue(id=ref_id, **ref_data.model_dump())
     doc = ref_value.model_dump()
-    result = await db.reference_values.update_one({"id": ref_id}, {"$set": doc})
+    async with revision_fields() as fields:
+        doc.update(fields)
+        result = await db.reference_values.update_one({"id": ref_id}, {"$set": doc})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Reference value not found")
     return ref_value
@@ -342,6 +556,7 @@ async def delete_reference_value(ref_id: str):
     result = await db.reference_values.delete_one({"id": ref_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Reference value not found")
+    await record_deletion("reference_values", ref_id)
     return {"message": "Reference value deleted successfully"}
 
 # Settings endpoints
@@ -372,52 +587,158 @@ async def upload_letterhead(file: UploadFile = File(...)):
     file_ext = Path(file.filename).suffix
     letterhead_id = str(uuid.uuid4())
     filename = f"letterhead_{letterhead_id}{file_ext}"
-    filepath = LETTERHEAD_DIR / filename
+    key = f"letterheads/{filename}"
     
     content = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(content)
+    await run_in_threadpool(get_storage().put, key, content, file.content_type)
     
-    return {"path": str(filepath), "filename": filename}
+    return {"path": key, "filename": filename}
 
 # Image upload endpoint
 @api_router.post("/exams/{exam_id}/images")
 async def upload_exam_image(exam_id: str, file: UploadFile = File(...), organ: Optional[str] = None):
     # Verify exam exists
-    exam = await db.exams.find_one({"id": exam_id})
-    if not exam:
+    if not await ensure_hot_exam(exam_id):
         raise HTTPException(status_code=404, detail="Exam not found")
     
     # Save file
     file_ext = Path(file.filename).suffix
     image_id = str(uuid.uuid4())
     filename = f"{image_id}{file_ext}"
-    filepath = IMAGES_DIR / filename
+    key = f"images/{filename}"
     
     content = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(content)
+    await run_in_threadpool(get_storage().put, key, content, file.content_type)
     
     # Create image record
     image = ExamImage(
         id=image_id,
         filename=filename,
         organ=organ,
-        path=str(filepath)
+        path=key
     )
     
     # Update exam
-    await db.exams.update_one(
-        {"id": exam_id},
-        {"$push": {"images": image.model_dump()}}
-    )
+    async with revision_fields() as fields:
+        await db.exams.update_one(
+            {"id": exam_id},
+            {"$push": {"images": image.model_dump()}, "$set": fields}
+        )
     
     return image
 
+# Batch image upload: Pillow decodes in a dedicated pool (it releases the GIL while
+# decoding), storage writes are bounded separately
+IMAGE_BATCH_MAX_FILES = int(os.environ.get("IMAGE_BATCH_MAX_FILES", "50"))
+IMAGE_DECODE_WORKERS = int(os.environ.get("IMAGE_DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_WRITE_CONCURRENCY = int(os.environ.get("IMAGE_WRITE_CONCURRENCY", "8"))
+
+_image_pool: Optional[ThreadPoolExecutor] = None
+
+def image_pool() -> ThreadPoolExecutor:
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ThreadPoolExecutor(max_workers=IMAGE_DECODE_WORKERS, thread_name_prefix="image-decode")
+    return _image_pool
+
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+def decode_image(content: bytes) -> str:
+    """Fully decode an uploaded image, returning its format; raises if it is not a valid image"""
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(content)) as img:
+        img.load()
+        return img.format
+
+@api_router.post("/exams/{exam_id}/images/batch")
+async def upload_exam_images(exam_id: str, files: List[UploadFile] = File(...), organ: Optional[str] = None):
+    """Upload several images to an exam in one request, with a result per file"""
+    if len(files) > IMAGE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {IMAGE_BATCH_MAX_FILES} files per upload")
+    if not await ensure_hot_exam(exam_id):
+        raise HTTPException(status_code=404, detail="Exam not found")
+    
+    loop = asyncio.get_running_loop()
+    storage = get_storage()
+    semaphore = asyncio.Semaphore(IMAGE_WRITE_CONCURRENCY)
+    
+    async def process(file: UploadFile) -> dict:
+        async with semaphore:
+            content = await file.read()
+            try:
+                image_format = await loop.run_in_executor(image_pool(), decode_image, content)
+            except Exception as e:
+                logger.warning(f"Rejected upload {file.filename}: {e}")
+                return {"filename": file.filename, "error": "Invalid or corrupted image"}
+            image_id = str(uuid.uuid4())
+            file_ext = Path(file.filename or "").suffix or f".{image_format.lower()}"
+            filename = f"{image_id}{file_ext}"
+            key = f"images/{filename}"
+            try:
+                await run_in_threadpool(storage.put, key, content, file.content_type)
+            except Exception as e:
+                logger.error(f"Error storing image {file.filename}: {e}")
+                return {"filename": file.filename, "error": "Image could not be stored"}
+            image = ExamImage(id=image_id, filename=filename, organ=organ, path=key)
+            return {"filename": file.filename, "image": image.model_dump()}
+    
+    results = await asyncio.gather(*(process(file) for file in files))
+    images = [result["image"] for result in results if "image" in result]
+    
+    if images:
+        # One write for the whole batch, in upload order
+        async with revision_fields() as fields:
+            result = await db.exams.update_one(
+                {"id": exam_id},
+                {"$push": {"images": {"$each": images}}, "$set": fields}
+            )
+        if result.matched_count == 0:
+            # The exam was deleted meanwhile; drop the orphaned files
+            for image in images:
+                await run_in_threadpool(storage.delete, image["path"])
+            raise HTTPException(status_code=404, detail="Exam not found")
+    
+    return {"uploaded": len(images), "failed": len(results) - len(images), "results": results}
+
+def resize_image(original: bytes, width: int) -> bytes:
+    """Downscale an image to at most ``width`` pixels wide as JPEG"""
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(original)) as img:
+        img.thumbnail((width, img.height))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, "JPEG", quality=85, optimize=True)
+    return output.getvalue()
+
+async def load_rendition(key: str, image_id: str, width: int) -> bytes:
+    """Fetch a stored rendition, generating and storing it on first request"""
+    storage = get_storage()
+    rendition = rendition_key(key, image_id, width)
+    try:
+        return await run_in_threadpool(storage.get, rendition)
+    except BlobNotFound:
+        pass
+    original = await run_in_threadpool(storage.get, key)
+    try:
+        content = await run_in_threadpool(resize_image, original, width)
+    except Exception as e:
+        logging.error(f"Error resizing image {image_id}: {e}")
+        raise HTTPException(status_code=422, detail="Image cannot be resized")
+    await run_in_threadpool(storage.put, rendition, content, "image/jpeg")
+    return content
+
 @api_router.get("/images/{image_id}")
-async def get_image(image_id: str):
+async def get_image(image_id: str, width: Optional[int] = None):
+    """Serve an exam image, or a downscaled JPEG rendition when ``width`` is given"""
     # Find the image
-    exam = await db.exams.find_one({"images.id": image_id})
+    exam = await find_exam_by_image(image_id)
     if not exam:
         raise HTTPException(status_code=404, detail="Image not found")
     
@@ -425,38 +746,92 @@ async def get_image(image_id: str):
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    filepath = Path(image["path"])
-    if not filepath.exists():
-        raise HTTPException(status_code=404, detail="Image file not found")
+    key = key_from_path(image["path"])
+    if width:
+        # Snap to the nearest configured width at or above the request
+        width = next((w for w in RENDITION_WIDTHS if w >= width), RENDITION_WIDTHS[-1])
+        try:
+            content = await image_flight.do(
+                rendition_key(key, image_id, width),
+                lambda: load_rendition(key, image_id, width)
+            )
+        except BlobNotFound:
+            raise HTTPException(status_code=404, detail="Image file not found")
+        return Response(content=content, media_type="image/jpeg")
     
-    return FileResponse(filepath)
+    local_path = get_storage().local_path(key)
+    if local_path:
+        return FileResponse(local_path)
+    
+    try:
+        content = await image_flight.do(key, lambda: run_in_threadpool(get_storage().get, key))
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="Image file not found")
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    return Response(content=content, media_type=media_type)
 
 @api_router.delete("/exams/{exam_id}/images/{image_id}")
 async def delete_exam_image(exam_id: str, image_id: str):
-    exam = await db.exams.find_one({"id": exam_id})
+    exam = await db.exams.find_one({"id": exam_id}) or await archive.restore_exam(db, exam_id)
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     
     # Find and delete image file
     image = next((img for img in exam.get("images", []) if img["id"] == image_id), None)
     if image:
-        filepath = Path(image["path"])
-        if filepath.exists():
-            filepath.unlink()
+        storage = get_storage()
+        key = key_from_path(image["path"])
+        await run_in_threadpool(storage.delete, key)
+        for width in RENDITION_WIDTHS:
+            await run_in_threadpool(storage.delete, rendition_key(key, image_id, width))
     
     # Remove from exam
-    await db.exams.update_one(
-        {"id": exam_id},
-        {"$pull": {"images": {"id": image_id}}}
-    )
+    async with revision_fields() as fields:
+        await db.exams.update_one(
+            {"id": exam_id},
+            {"$pull": {"images": {"id": image_id}}, "$set": fields}
+        )
     
     return {"message": "Image deleted successfully"}
 
-# Export to DOCX endpoint
+# Export to DOCX
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def content_disposition(filename: str) -> str:
+    """Build an attachment header, RFC 5987-encoding non-ASCII filenames"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+# Persisted reports: reports/laudo_<id>.docx plus a .version stamp naming the
+# content version it was rendered from and a digest of the stored file
+def report_stamp(version: str, content: bytes) -> bytes:
+    return f"{version} {hashlib.sha256(content).hexdigest()[:16]}".encode()
+
+async def load_persisted_report(exam_id: str, version: str) -> Optional[bytes]:
+    """Stored report for this content version, None when missing or stale"""
+    storage = get_storage()
+    try:
+        stamp = await run_in_threadpool(storage.get, f"reports/laudo_{exam_id}.version")
+        if not stamp.startswith(f"{version} ".encode()):
+            return None
+        content = await run_in_threadpool(storage.get, f"reports/laudo_{exam_id}.docx")
+    except BlobNotFound:
+        return None
+    # The file and its stamp are written separately; a concurrent persist may sit in between
+    return content if stamp == report_stamp(version, content) else None
+
+async def persist_report(exam_id: str, version: str, content: bytes):
+    storage = get_storage()
+    await run_in_threadpool(storage.put, f"reports/laudo_{exam_id}.docx", content, DOCX_MEDIA_TYPE)
+    await run_in_threadpool(storage.put, f"reports/laudo_{exam_id}.version", report_stamp(version, content), "text/plain")
+
 @api_router.get("/exams/{exam_id}/export")
-async def export_exam_to_docx(exam_id: str):
+async def export_exam_to_docx(exam_id: str, persist: bool = False):
+    """Export the exam report as DOCX, reusing the stored copy when ``persist=true``"""
     # Get exam and patient data
-    exam = await db.exams.find_one({"id": exam_id}, {"_id": 0})
+    exam = parse_from_mongo(await find_exam(exam_id))
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     
@@ -466,262 +841,28 @@ async def export_exam_to_docx(exam_id: str):
     
     settings = await db.settings.find_one({"id": "global_settings"}, {"_id": 0})
     
-    # Create document - use letterhead template if available
-    letterhead_path = settings.get("letterhead_path") if settings else None
+    # Imported on first use so python-docx does not slow down worker boot
+    from report import render_exam_report
     
-    if letterhead_path and Path(letterhead_path).exists():
-        # Use the uploaded letterhead as template
-        # The letterhead has header/footer, and empty body - perfect for inserting laudo
-        try:
-            doc = Document(letterhead_path)
-            logging.info(f"Using letterhead template: {letterhead_path}")
-            # Clear any existing content in body (should be empty already)
-            for para in doc.paragraphs[:]:
-                para.clear()
-        except Exception as e:
-            logging.error(f"Error loading letterhead: {e}")
-            doc = Document()
-            # Fallback to text-based header
-            if settings and settings.get("clinic_name"):
-                heading = doc.add_heading(settings["clinic_name"], level=1)
-                heading.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                if settings.get("clinic_address"):
-                    addr = doc.add_paragraph(settings["clinic_address"])
-                    addr.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                if settings.get("veterinarian_name") or settings.get("crmv"):
-                    vet_info = f"{settings.get('veterinarian_name', '')} - CRMV: {settings.get('crmv', '')}"
-                    vet_para = doc.add_paragraph(vet_info)
-                    vet_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                doc.add_paragraph()
-    else:
-        # No letterhead file, create new document with text header
-        doc = Document()
-        if settings and settings.get("clinic_name"):
-            heading = doc.add_heading(settings["clinic_name"], level=1)
-            heading.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            
-            if settings.get("clinic_address"):
-                addr = doc.add_paragraph(settings["clinic_address"])
-                addr.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            
-            if settings.get("veterinarian_name") or settings.get("crmv"):
-                vet_info = f"{settings.get('veterinarian_name', '')} - CRMV: {settings.get('crmv', '')}"
-                vet_para = doc.add_paragraph(vet_info)
-                vet_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            
-            doc.add_paragraph()  # Spacer
-    
-    # Add title
-    try:
-        title = doc.add_heading('LAUDO DE ULTRASSONOGRAFIA ABDOMINAL', level=1)
-        title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    except KeyError:
-        para = doc.add_paragraph('LAUDO DE ULTRASSONOGRAFIA ABDOMINAL')
-        run = para.runs[0]
-        run.bold = True
-        run.font.size = Pt(16)
-        para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    
-    doc.add_paragraph()
-    
-    # Patient information
-    try:
-        doc.add_heading('Dados do Paciente', level=2)
-    except KeyError:
-        para = doc.add_paragraph('Dados do Paciente')
-        run = para.runs[0]
-        run.bold = True
-        run.font.size = Pt(14)
-        para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
-    para = doc.add_paragraph(f"Nome: {patient['name']}")
-    para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-    para = doc.add_paragraph(f"Espécie: {'Canino' if patient['species'] == 'dog' else 'Felino'}")
-    para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-    para = doc.add_paragraph(f"Raça: {patient['breed']}")
-    para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-    
-    # Use exam weight if available, otherwise use patient weight
-    weight = exam.get('exam_weight') or patient['weight']
-    doc.add_paragraph(f"Peso: {weight} kg")
-    
-    doc.add_paragraph(f"Porte: {patient['size'].capitalize()}")
-    doc.add_paragraph(f"Sexo: {'Macho' if patient['sex'] == 'male' else 'Fêmea'}")
-    if patient.get('is_neutered'):
-        doc.add_paragraph("Paciente Castrado")
-    if patient.get('owner_name'):
-        doc.add_paragraph(f"Tutor: {patient['owner_name']}")
+    version = content_version(exam, patient, settings)
+    content = await load_persisted_report(exam_id, version) if persist else None
+    if content is None:
+        # Concurrent exports of the same exam content share a single render;
+        # python-docx is blocking, keep it off the event loop
+        content = await export_flight.do(
+            f"{exam_id}:{version}",
+            lambda: run_in_threadpool(render_exam_report, exam, patient, settings, load_blob)
+        )
+        if persist:
+            await persist_report(exam_id, version, content)
     
     exam_date = exam.get('exam_date')
-    if isinstance(exam_date, str):
-        exam_date = datetime.fromisoformat(exam_date)
-    doc.add_paragraph(f"Data do Exame: {exam_date.strftime('%d/%m/%Y')}")
-    doc.add_paragraph()
+    filename = f"laudo_{patient['name']}_{exam_date.strftime('%Y%m%d')}.docx"
     
-    # Organ findings with humanized text
-    try:
-        doc.add_heading('Achados Ultrassonográficos', level=2)
-    except KeyError:
-        # Timbrado template may not have Heading styles
-        para = doc.add_paragraph('Achados Ultrassonográficos')
-        run = para.runs[0]
-        run.bold = True
-        run.font.size = Pt(14)
-        para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
-    
-    organs_data = exam.get('organs_data', [])
-    for organ_data in organs_data:
-        if organ_data.get('report_text') or organ_data.get('measurements'):
-            # Try to add heading, fallback to bold paragraph if style doesn't exist
-            try:
-                doc.add_heading(organ_data['organ_name'], level=3)
-            except KeyError:
-                para = doc.add_paragraph(organ_data['organ_name'])
-                run = para.runs[0]
-                run.bold = True
-                run.font.size = Pt(12)
-                para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
-            
-            # Generate humanized text with measurements
-            measurements = organ_data.get('measurements', {})
-            report_text = organ_data.get('report_text', '')
-            
-            # Format measurements string
-            measurements_str = ""
-            if measurements:
-                measurement_values = list(measurements.values())
-                organ_name = organ_data['organ_name']
-                
-                # Check if it's adrenal (special format)
-                if 'Adrenal' in organ_name:
-                    if len(measurement_values) >= 3:
-                        measurements_str = f"{measurement_values[0]['value']}x{measurement_values[1]['value']}x{measurement_values[2]['value']} cm"
-                    else:
-                        measurements_str = ' x '.join([f"{m['value']}" for m in measurement_values]) + " cm"
-                elif len(measurement_values) == 1:
-                    measurements_str = f"{measurement_values[0]['value']} cm"
-                else:
-                    measurements_str = ' x '.join([f"{m['value']}" for m in measurement_values]) + " cm"
-            
-            # Process report text with {MEDIDA} placeholder and formatting
-            if report_text:
-                # Replace {MEDIDA} with actual measurements
-                if '{MEDIDA}' in report_text and measurements_str:
-                    processed_text = report_text.replace('{MEDIDA}', f"medindo aproximadamente {measurements_str}")
-                else:
-                    # If no {MEDIDA} but has measurements, add at start
-                    if measurements_str:
-                        processed_text = f"{organ_data['organ_name']} medindo aproximadamente {measurements_str}, {report_text}"
-                    else:
-                        processed_text = f"{organ_data['organ_name']} {report_text}"
-                
-                # Create paragraph with formatting
-                para = doc.add_paragraph()
-                para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-                
-                # Process markdown-style formatting
-                import re
-                
-                # Split by bold (**text**)
-                parts = re.split(r'(\*\*.*?\*\*)', processed_text)
-                for part in parts:
-                    if part.startswith('**') and part.endswith('**'):
-                        # Bold text
-                        run = para.add_run(part[2:-2])
-                        run.bold = True
-                    else:
-                        # Check for italic (*text*)
-                        italic_parts = re.split(r'(\*.*?\*)', part)
-                        for ipart in italic_parts:
-                            if ipart.startswith('*') and ipart.endswith('*') and not ipart.startswith('**'):
-                                run = para.add_run(ipart[1:-1])
-                                run.italic = True
-                            elif ipart:
-                                para.add_run(ipart)
-            elif measurements_str:
-                # Only measurements, no report text
-                para = doc.add_paragraph(f"{organ_data['organ_name']} medindo aproximadamente {measurements_str}.")
-                para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-            
-            doc.add_paragraph()
-    
-    # Add images in 2 columns at the end
-    images = exam.get('images', [])
-    if images:
-        doc.add_page_break()
-        
-        # Add title
-        try:
-            title_para = doc.add_heading('Imagens do Exame', level=2)
-            title_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-        except KeyError:
-            para = doc.add_paragraph('Imagens do Exame')
-            run = para.runs[0]
-            run.bold = True
-            run.font.size = Pt(14)
-            para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-        
-        # Add table for 2-column layout
-        from docx.oxml import OxmlElement
-        from docx.oxml.ns import qn
-        
-        image_count = 0
-        for i in range(0, len(images), 6):  # Process 6 images at a time
-            # Add spacing before table if not first
-            if i > 0:
-                doc.add_paragraph()
-            
-            # Create table: 3 rows x 2 columns for images
-            table = doc.add_table(rows=3, cols=2)
-            table.autofit = False
-            table.allow_autofit = False
-            
-            # Set column widths (make them equal)
-            for row in table.rows:
-                for cell in row.cells:
-                    cell.width = Inches(3.2)
-            
-            batch = images[i:i+6]
-            for idx, img in enumerate(batch):
-                try:
-                    filepath = Path(img['path'])
-                    if filepath.exists():
-                        row_idx = idx // 2
-                        col_idx = idx % 2
-                        cell = table.rows[row_idx].cells[col_idx]
-                        
-                        # Add image to cell with better sizing
-                        paragraph = cell.paragraphs[0]
-                        paragraph.clear()  # Clear any default content
-                        run = paragraph.add_run()
-                        
-                        # Use slightly smaller image size for better fit
-                        run.add_picture(str(filepath), width=Inches(2.5))
-                        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                        
-                        # Add caption
-                        if img.get('organ'):
-                            caption_para = cell.add_paragraph(img['organ'])
-                            caption_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                            for run in caption_para.runs:
-                                run.font.size = Pt(8)
-                                run.font.italic = True
-                        
-                        image_count += 1
-                except Exception as e:
-                    logging.error(f"Error adding image to document: {e}")
-            
-            # Add page break after 6 images if there are more
-            if i + 6 < len(images):
-                doc.add_page_break()
-    
-    # Save document
-    output_path = REPORTS_DIR / f"laudo_{exam_id}.docx"
-    doc.save(str(output_path))
-    
-    return FileResponse(
-        path=output_path,
-        filename=f"laudo_{patient['name']}_{exam_date.strftime('%Y%m%d')}.docx",
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    return Response(
+        content=content,
+        media_type=DOCX_MEDIA_TYPE,
+        headers={"Content-Disposition": content_disposition(filename)}
     )
 
 # License endpoints
@@ -729,9 +870,15 @@ async def export_exam_to_docx(exam_id: str):
 async def get_license_status():
     """Check current license status"""
     # Check if there's an active license
+    now = datetime.now(timezone.utc)
     active_license = await db.licenses.find_one({
         "is_used": True,
-        "expires_at": {"$gt": datetime.now(timezone.utc).isoformat()}
+        # Range queries only match values of the same BSON type, so also accept
+        # licenses not yet converted by migrate_datetimes.py
+        "$or": [
+            {"expires_at": {"$gt": now}},
+            {"expires_at": {"$gt": now.isoformat()}}
+        ]
     })
     
     # Count remaining codes
@@ -752,7 +899,7 @@ async def get_license_status():
         )
     
     if active_license:
-        expires_at = datetime.fromisoformat(active_license["expires_at"])
+        expires_at = parse_from_mongo(active_license)["expires_at"]
         return LicenseStatus(
             is_active=True,
             needs_activation=False,
@@ -790,8 +937,8 @@ async def activate_license(code: str):
         {
             "$set": {
                 "is_used": True,
-                "used_at": datetime.now(timezone.utc).isoformat(),
-                "expires_at": expires_at.isoformat()
+                "used_at": datetime.now(timezone.utc),
+                "expires_at": expires_at
             }
         }
     )
@@ -801,8 +948,8 @@ async def activate_license(code: str):
         "id": str(uuid.uuid4()),
         "code": code,
         "is_used": True,
-        "used_at": datetime.now(timezone.utc).isoformat(),
-        "expires_at": expires_at.isoformat()
+        "used_at": datetime.now(timezone.utc),
+        "expires_at": expires_at
     }
     await db.licenses.insert_one(license_record)
     
@@ -891,8 +1038,7 @@ async def initialize_defaults():
         ])
     
     # Insert templates
-    for template in templates:
-        await db.templates.insert_one(template.model_dump())
+    await insert_stamped("templates", [template.model_dump() for template in templates])
     
     # Default reference values (simplified example)
     ref_values = [
@@ -913,11 +1059,159 @@ async def initialize_defaults():
         ReferenceValue(organ="Baço", measurement_type="espessura", species="dog", size="large", min_value=1.5, max_value=2.5, unit="cm"),
     ]
     
-    for ref_value in ref_values:
-        await db.reference_values.insert_one(ref_value.model_dump())
+    await insert_stamped("reference_values", [ref_value.model_dump() for ref_value in ref_values])
     
     return {"message": "Default data initialized successfully"}
 
+# Delta sync endpoint
+@api_router.get("/sync")
+async def sync_changes(since: int = 0, limit: int = 500):
+    """Changes after ``since`` (the previous ``watermark``, 0 for a full load); call again while ``has_more``"""
+    # Documents written before revisions existed must be stamped before a full load
+    await ensure_sync_ready()
+    limit = max(1, min(limit, SYNC_MAX_BATCH))
+    models = {"patients": Patient, "exams": Exam, "templates": TemplateText, "reference_values": ReferenceValue}
+    
+    # Stop below writes still in flight, or a client could skip past them
+    window = {"$gt": since, "$lte": await revisions.stable_revision(db)}
+    
+    # Fetch one extra row per source so has_more is exact
+    changes = []
+    for name in SYNC_COLLECTIONS:
+        projection = projection_for(models[name])
+        projection["revision"] = 1
+        docs = await db[name].find({"revision": window}, projection).sort("revision", 1).to_list(limit + 1)
+        changes.extend((doc["revision"], name, doc) for doc in docs)
+    tombstones = await db.tombstones.find(
+        {"revision": window}, {"_id": 0}
+    ).sort("revision", 1).to_list(limit + 1)
+    changes.extend((t["revision"], "deleted", t) for t in tombstones)
+    
+    changes.sort(key=lambda change: change[0])
+    batch = changes[:limit]
+    
+    response = {name: [] for name in SYNC_COLLECTIONS}
+    response["deleted"] = {name: [] for name in SYNC_COLLECTIONS}
+    for _, kind, doc in batch:
+        if kind == "deleted":
+            response["deleted"][doc["collection"]].append(doc["id"])
+        else:
+            response[kind].append(doc)
+    response["watermark"] = batch[-1][0] if batch else since
+    response["has_more"] = len(changes) > limit
+    return trusted_response(response)
+
+# Archival endpoint; each call handles a bounded batch so it fits in one request
+ARCHIVE_RUN_LIMIT = 100
+ARCHIVE_MAX_RUN_LIMIT = 1000
+
+@api_router.post("/archive/run")
+async def run_archive(
+    older_than_days: int = archive.ARCHIVE_AFTER_DAYS,
+    limit: int = ARCHIVE_RUN_LIMIT,
+    image_quality: Optional[int] = archive.ARCHIVE_IMAGE_QUALITY
+):
+    """Archive up to ``limit`` exams older than ``older_than_days``; call again while ``has_more``"""
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
+    if not 1 <= limit <= ARCHIVE_MAX_RUN_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {ARCHIVE_MAX_RUN_LIMIT}")
+    if image_quality is not None and not 1 <= image_quality <= 95:
+        raise HTTPException(status_code=400, detail="image_quality must be between 1 and 95")
+    return trusted_response(await archive.run_archival(db, get_storage(), older_than_days, limit, image_quality))
+
+# Bulk export / import
+BULK_MODELS = {"patients": Patient, "exams": Exam, "templates": TemplateText, "reference_values": ReferenceValue}
+BULK_BATCH_SIZE = 500
+BULK_MAX_BATCH_SIZE = 5000
+
+@api_router.get("/bulk/export")
+async def bulk_export(
+    fmt: str = Query("ndjson", alias="format"),
+    datasets: str = "patients,exams,templates,reference_values",
+    batch_size: int = BULK_BATCH_SIZE
+):
+    """Stream clinic data as NDJSON (any datasets) or Parquet (one dataset).
+
+    Datasets: patients, exams, exam_measurements, templates, reference_values.
+    """
+    names = [name.strip() for name in datasets.split(",") if name.strip()]
+    unknown = [name for name in names if name not in bulk.DATASETS]
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown datasets: {', '.join(unknown) or '(none)'}")
+    batch_size = max(1, min(batch_size, BULK_MAX_BATCH_SIZE))
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    
+    if fmt == "ndjson":
+        return StreamingResponse(
+            bulk.ndjson_stream(db, names, batch_size),
+            media_type=bulk.NDJSON_MEDIA_TYPE,
+            headers={"Content-Disposition": content_disposition(f"tvusvet_{stamp}.ndjson")}
+        )
+    if fmt == "parquet":
+        if len(names) != 1:
+            raise HTTPException(status_code=400, detail="Parquet export takes exactly one dataset")
+        if not bulk.parquet_available():
+            raise HTTPException(status_code=501, detail="Parquet support requires pyarrow")
+        return StreamingResponse(
+            bulk.parquet_stream(db, names[0], batch_size),
+            media_type=bulk.PARQUET_MEDIA_TYPE,
+            headers={"Content-Disposition": content_disposition(f"tvusvet_{names[0]}_{stamp}.parquet")}
+        )
+    raise HTTPException(status_code=400, detail="Format must be ndjson or parquet")
+
+@api_router.post("/bulk/import")
+async def bulk_import(
+    file: UploadFile = File(...),
+    fmt: str = Query("ndjson", alias="format"),
+    collection: Optional[str] = None,
+    batch_size: int = BULK_BATCH_SIZE
+):
+    """Upsert documents by id from an NDJSON export, or a Parquet export of ``collection``"""
+    importer = bulk.BulkImporter(db, BULK_MODELS, max(1, min(batch_size, BULK_MAX_BATCH_SIZE)), prepare_for_mongo)
+    
+    if fmt == "ndjson":
+        async for line_number, line in bulk.iter_ndjson_lines(file):
+            try:
+                record = orjson.loads(line)
+                await importer.add(record["collection"], record["doc"], line_number)
+            except (ValueError, KeyError, TypeError) as e:
+                importer.error(line_number, e)
+    elif fmt == "parquet":
+        if collection not in bulk.IMPORTABLE:
+            raise HTTPException(status_code=400, detail=f"collection must be one of: {', '.join(bulk.IMPORTABLE)}")
+        if not bulk.parquet_available():
+            raise HTTPException(status_code=501, detail="Parquet support requires pyarrow")
+        # Parquet reading is blocking; pull one row group at a time off the event loop
+        batches = bulk.iter_parquet(file.file, importer.batch_size)
+        row_number = 0
+        while (rows := await run_in_threadpool(next, batches, None)) is not None:
+            for row in rows:
+                row_number += 1
+                try:
+                    await importer.add(collection, bulk.decode_row(collection, row), row_number)
+                except (ValueError, KeyError, TypeError) as e:
+                    importer.error(row_number, e)
+    else:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or parquet")
+    
+    await importer.flush_all()
+    return importer.summary()
+
+# Health check
+@api_router.get("/health")
+async def health_check():
+    """Database reachability, pool statistics and request coalescing counters"""
+    try:
+        return {
+            "status": "ok",
+            "database": await database.health(),
+            "coalescing": {"export": export_flight.stats(), "image": image_flight.stats()},
+        }
+    except Exception as e:
+        logging.error(f"Health check failed: {e}")
+        return UTCJSONResponse(status_code=503, content={"status": "unavailable", "error": str(e)})
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -935,7 +1229,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
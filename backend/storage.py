@@ -0,0 +1,234 @@
+"""Blob storage for uploaded images, letterheads and cached reports.
+
+Records in Mongo store keys relative to the storage root (``images/<id>.jpg``,
+``letterheads/<file>.docx``, ``reports/laudo_<id>.docx``) instead of absolute
+filesystem paths, so every worker and host resolves them the same way.
+
+The backend is selected from the environment:
+
+    STORAGE_BACKEND      "local" (default), "s3" or "memory"
+    STORAGE_LOCAL_ROOT   root directory for the local backend (backend/uploads)
+    S3_BUCKET            bucket name for the s3 backend
+    S3_PREFIX            optional key prefix inside the bucket
+    S3_ENDPOINT_URL      custom endpoint, e.g. http://localhost:9000 for MinIO
+    S3_REGION            bucket region
+
+S3 credentials come from the usual boto3 chain (AWS_ACCESS_KEY_ID, profiles,
+instance roles). Pointing S3_ENDPOINT_URL at a local MinIO server gives a
+stand-in for the s3 backend in development. The "memory" backend keeps blobs
+in a dict, for tests and throwaway instances.
+
+All methods are blocking; call them through ``run_in_threadpool`` from async code.
+"""
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePosixPath, PureWindowsPath
+from typing import Dict, Optional
+
+ROOT_DIR = Path(__file__).parent
+UPLOAD_DIR = ROOT_DIR / "uploads"
+
+
+class BlobNotFound(Exception):
+    """Raised when a key does not exist in the storage backend"""
+
+
+def normalize_key(key: str) -> str:
+    """Validate a relative storage key and return it in canonical form"""
+    path = PurePosixPath(key.replace("\\", "/"))
+    if path.is_absolute() or ".." in path.parts or not path.parts:
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return str(path)
+
+
+def key_from_path(path: str) -> str:
+    """Map a stored path to a storage key.
+
+    Older records hold absolute paths such as ``/app/backend/uploads/images/x.jpg``;
+    the key is whatever follows the ``uploads`` directory. Relative values are
+    already keys.
+    """
+    posix_path = PurePosixPath(path.replace("\\", "/"))
+    if not (posix_path.is_absolute() or PureWindowsPath(path).is_absolute()):
+        return normalize_key(path)
+    parts = posix_path.parts
+    if "uploads" in parts:
+        index = len(parts) - 1 - parts[::-1].index("uploads")
+        return normalize_key("/".join(parts[index + 1:]))
+    return normalize_key("/".join(parts[-2:]))
+
+
+# Archived exams keep their images (and the renditions of those) under this prefix
+ARCHIVE_AREA = "archive"
+
+# Image renditions are generated for these widths only, so they can be cleaned up
+RENDITION_WIDTHS = (160, 320, 640, 1280)
+
+
+def is_archived_key(key: str) -> bool:
+    return PurePosixPath(key).parts[0] == ARCHIVE_AREA
+
+
+def rendition_key(image_key: str, image_id: str, width: int) -> str:
+    """Key of a downscaled JPEG rendition, stored in the same area as its image"""
+    key = f"renditions/{image_id}_w{width}.jpg"
+    return f"{ARCHIVE_AREA}/{key}" if is_archived_key(image_key) else key
+
+
+class BlobStorage(ABC):
+    """Interface implemented by the storage backends"""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Blob content; raises BlobNotFound when the key does not exist"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a blob; missing keys are ignored"""
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path for the key, when the backend has one (lets callers use sendfile)"""
+        return None
+
+
+class LocalBlobStorage(BlobStorage):
+    """Stores blobs under a local directory"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / normalize_key(key)
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a unique temp file first so concurrent writers never interleave
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        return path if path.is_file() else None
+
+
+class MemoryBlobStorage(BlobStorage):
+    """Keeps blobs in a dict; nothing survives the process"""
+
+    def __init__(self):
+        self._blobs: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        with self._lock:
+            self._blobs[normalize_key(key)] = bytes(data)
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            try:
+                return self._blobs[normalize_key(key)]
+            except KeyError:
+                raise BlobNotFound(key)
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            return normalize_key(key) in self._blobs
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._blobs.pop(normalize_key(key), None)
+
+
+class S3BlobStorage(BlobStorage):
+    """Stores blobs in an S3-compatible bucket (AWS S3, MinIO, ...)"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region_name: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # boto3 clients are thread-safe, one is shared by the whole worker
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+
+    def _key(self, key: str) -> str:
+        key = normalize_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, **extra)
+
+    def get(self, key: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(key)
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+_storage: Optional[BlobStorage] = None
+
+
+def get_storage() -> BlobStorage:
+    """Shared backend, created on first use (the app lifespan initializes it at startup)"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def create_storage() -> BlobStorage:
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    backend = os.environ.get("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalBlobStorage(Path(os.environ.get("STORAGE_LOCAL_ROOT", UPLOAD_DIR)))
+    if backend == "memory":
+        return MemoryBlobStorage()
+    if backend == "s3":
+        return S3BlobStorage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", ""),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+            region_name=os.environ.get("S3_REGION") or None,
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r}")
@@ -0,0 +1,53 @@
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from PIL import Image
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+
+PATIENT = {"name": "Rex", "species": "dog", "breed": "SRD", "weight": 3.0, "size": "small", "sex": "male"}
+
+
+def png_bytes(color="red", size=(64, 48)) -> bytes:
+    """A PNG filled with ``color``, or with noise (which compresses badly) when it is None"""
+    image = Image.new("RGB", size, color) if color else Image.effect_noise(size, 60).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    import revisions
+
+    # Counter values seen by this process refer to the previous test's database
+    monkeypatch.setattr(revisions, "_last_seen", 0)
+    return AsyncMongoMockClient(tz_aware=True)["test"]
+
+
+@pytest.fixture
+def server_db(db, monkeypatch, tmp_path):
+    """The app module wired to an in-memory database and local storage under tmp_path"""
+    import server
+    import storage
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "_sync_setup", None)
+    monkeypatch.setattr(storage, "_storage", storage.LocalBlobStorage(tmp_path / "uploads"))
+    return db
+
+
+@pytest.fixture
+def client(server_db):
+    import server
+
+    return TestClient(server.app)
@@ -0,0 +1,127 @@
+import asyncio
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from PIL import Image
+
+import archive
+import revisions
+from storage import LocalBlobStorage, rendition_key
+
+from .conftest import png_bytes
+
+OLD = datetime(2015, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalBlobStorage(tmp_path / "uploads")
+
+
+async def add_exam(db, storage, exam_id, exam_date=OLD):
+    image = {"id": f"img-{exam_id}", "filename": f"img-{exam_id}.png", "organ": None,
+             "path": f"images/img-{exam_id}.png"}
+    storage.put(image["path"], png_bytes(None, (200, 150)))
+    storage.put(rendition_key(image["path"], image["id"], 160), b"rendition")
+    await db.exams.insert_one({"id": exam_id, "patient_id": "p", "exam_date": exam_date,
+                               "images": [image], "revision": 1})
+    return image
+
+
+def test_archival_moves_images_and_renditions_unchanged(db, storage):
+    async def scenario():
+        image = await add_exam(db, storage, "e1")
+        original = storage.get(image["path"])
+        result = await archive.run_archival(db, storage, older_than_days=365, quality=None)
+        return image, original, result, await archive.find_archived(db, {"id": "e1"})
+
+    image, original, result, archived = asyncio.run(scenario())
+    assert result["archived"] == 1 and result["has_more"] is False
+    moved = archived["images"][0]
+    assert moved["path"] == "archive/images/img-e1.png"
+    assert moved["filename"] == "img-e1.png"
+    assert storage.get(moved["path"]) == original
+    assert not storage.exists(image["path"])
+    assert not storage.exists(rendition_key(image["path"], image["id"], 160))
+    assert storage.get(rendition_key(moved["path"], image["id"], 160)) == b"rendition"
+
+
+def test_lossy_recompression_is_opt_in_and_renames(db, storage):
+    async def scenario():
+        await add_exam(db, storage, "e1")
+        await archive.run_archival(db, storage, older_than_days=365, quality=60)
+        return await archive.find_archived(db, {"id": "e1"})
+
+    moved = asyncio.run(scenario())["images"][0]
+    assert moved["path"] == "archive/images/img-e1.jpg"
+    assert moved["filename"] == "img-e1.jpg"
+    assert Image.open(io.BytesIO(storage.get(moved["path"]))).format == "JPEG"
+
+
+def test_archival_runs_in_bounded_batches(db, storage):
+    async def scenario():
+        for i in range(3):
+            await add_exam(db, storage, f"e{i}")
+        await add_exam(db, storage, "recent", exam_date=datetime.now(timezone.utc))
+        first = await archive.run_archival(db, storage, older_than_days=365, limit=2)
+        second = await archive.run_archival(db, storage, older_than_days=365, limit=2)
+        return first, second, await db.exams.count_documents({})
+
+    first, second, remaining = asyncio.run(scenario())
+    assert (first["archived"], first["has_more"]) == (2, True)
+    assert (second["archived"], second["has_more"]) == (1, False)
+    assert remaining == 1
+
+
+def test_archival_covers_unmigrated_string_dates(db, storage):
+    async def scenario():
+        await add_exam(db, storage, "old", exam_date=OLD.isoformat())
+        await add_exam(db, storage, "recent", exam_date=datetime.now(timezone.utc).isoformat())
+        result = await archive.run_archival(db, storage, older_than_days=365)
+        return result, await db.exams.distinct("id")
+
+    result, remaining = asyncio.run(scenario())
+    assert (result["archived"], result["has_more"]) == (1, False)
+    assert remaining == ["recent"]
+
+
+def test_listing_with_archived_exams_stays_capped(client, server_db):
+    def exam(i):
+        return {"id": f"e{i}", "patient_id": "p", "exam_date": OLD + timedelta(days=i), "revision": 1}
+
+    async def scenario():
+        await server_db.exams.insert_many([exam(i) for i in range(600, 1200)])
+        await server_db.exams_archive.insert_many([archive.compress_exam(exam(i)) for i in range(600)])
+
+    asyncio.run(scenario())
+    exams = client.get("/api/exams", params={"include_archived": "true"}).json()
+    assert len(exams) == 1000
+    assert (exams[0]["id"], exams[-1]["id"]) == ("e1199", "e200")
+
+
+def test_changed_exam_is_not_archived(db, storage):
+    async def scenario():
+        image = await add_exam(db, storage, "e1")
+        exam = await db.exams.find_one({"id": "e1"}, {"_id": 0})
+        await db.exams.update_one({"id": "e1"}, {"$set": {"revision": 2}})
+        archived = await archive.archive_exam(db, storage, exam)
+        return image, archived, await db.exams_archive.count_documents({})
+
+    image, archived, archive_count = asyncio.run(scenario())
+    assert archived is False and archive_count == 0
+    assert storage.exists(image["path"])
+    assert not storage.exists(f"archive/{image['path']}")
+
+
+def test_restored_exam_gets_a_fresh_revision(db, storage):
+    async def scenario():
+        await add_exam(db, storage, "e1")
+        await archive.run_archival(db, storage, older_than_days=365)
+        stable = await revisions.stable_revision(db)
+        await archive.restore_exam(db, "e1")
+        return stable, await db.exams.find_one({"id": "e1"})
+
+    stable, restored = asyncio.run(scenario())
+    assert restored["revision"] > stable
+    assert not restored["images"][0]["path"].startswith("images/")
@@ -0,0 +1,96 @@
+import asyncio
+import io
+
+import orjson
+import pytest
+
+import bulk
+
+
+def patient(patient_id, name):
+    return {"id": patient_id, "name": name, "species": "dog", "breed": "SRD",
+            "weight": 3.0, "size": "small", "sex": "male"}
+
+
+def ndjson(*records) -> bytes:
+    return b"".join(orjson.dumps(record) + b"\n" for record in records)
+
+
+def test_import_reports_invalid_rows_and_keeps_going(client, server_db):
+    payload = ndjson(
+        {"collection": "patients", "doc": patient("p1", "Rex")},
+        {"collection": "patients", "doc": {"id": "p2"}},
+        {"collection": "exam_measurements", "doc": {"exam_id": "e1"}},
+        {"collection": "patients", "doc": patient("p3", "Mia")},
+    )
+    summary = client.post("/api/bulk/import", files={"file": ("x.ndjson", payload)}).json()
+    assert summary["collections"]["patients"]["upserted"] == 2
+    assert summary["skipped"] == 1
+    assert [error["row"] for error in summary["errors"]] == [2]
+
+
+def test_write_errors_are_reported_per_row(client, server_db):
+    asyncio.run(server_db.patients.create_index("name", unique=True))
+    payload = ndjson(
+        {"collection": "patients", "doc": patient("p1", "Rex")},
+        {"collection": "patients", "doc": patient("p2", "Rex")},
+        {"collection": "patients", "doc": patient("p3", "Mia")},
+        {"collection": "patients", "doc": patient("p4", "Mia")},
+        {"collection": "patients", "doc": patient("p5", "Bob")},
+    )
+    response = client.post("/api/bulk/import?batch_size=2", files={"file": ("x.ndjson", payload)})
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["collections"]["patients"]["upserted"] == 3
+    assert summary["error_count"] == 2
+    assert [error["row"] for error in summary["errors"]] == [2, 4]
+    assert asyncio.run(server_db.patients.count_documents({})) == 3
+
+
+def test_export_round_trips_through_import(client, server_db):
+    client.post("/api/patients", json={k: v for k, v in patient("ignored", "Rex").items() if k != "id"})
+    exported = client.get("/api/bulk/export?datasets=patients").content
+    asyncio.run(server_db.patients.delete_many({}))
+
+    summary = client.post("/api/bulk/import", files={"file": ("x.ndjson", io.BytesIO(exported))}).json()
+    assert summary["collections"]["patients"]["upserted"] == 1
+    assert summary["error_count"] == 0
+
+
+def test_parquet_export_round_trips_through_import(client, server_db):
+    pytest.importorskip("pyarrow")
+    for name in ("Rex", "Mel", "Bob"):
+        client.post("/api/patients", json={k: v for k, v in patient("ignored", name).items() if k != "id"})
+    before = {p["id"]: p for p in client.get("/api/patients").json()}
+    exported = client.get("/api/bulk/export?format=parquet&datasets=patients&batch_size=2").content
+    asyncio.run(server_db.patients.delete_many({}))
+
+    summary = client.post("/api/bulk/import?format=parquet&collection=patients",
+                          files={"file": ("x.parquet", io.BytesIO(exported))}).json()
+    assert summary["collections"]["patients"]["upserted"] == 3
+    assert summary["error_count"] == 0
+    assert {p["id"]: p for p in client.get("/api/patients").json()} == before
+
+
+def test_flatten_measurements():
+    exam = {"id": "e1", "patient_id": "p1", "organs_data": [
+        {"organ_name": "Rim", "measurements": {"comprimento": {"value": 4.2, "unit": "cm", "is_abnormal": True}}},
+        {"organ_name": "Baço", "measurements": {}},
+    ]}
+    rows = list(bulk.flatten_measurements(exam))
+    assert rows == [{
+        "exam_id": "e1", "patient_id": "p1", "exam_date": None, "organ_name": "Rim",
+        "measurement": "comprimento", "value": 4.2, "unit": "cm", "is_abnormal": True,
+    }]
+
+
+def test_reimported_document_is_no_longer_reported_deleted(client):
+    created = client.post("/api/patients", json={k: v for k, v in patient("ignored", "Rex").items() if k != "id"}).json()
+    exported = client.get("/api/bulk/export?datasets=patients").content
+    client.delete(f"/api/patients/{created['id']}")
+    assert client.get("/api/sync").json()["deleted"]["patients"] == [created["id"]]
+
+    client.post("/api/bulk/import", files={"file": ("x.ndjson", io.BytesIO(exported))})
+    synced = client.get("/api/sync").json()
+    assert [p["id"] for p in synced["patients"]] == [created["id"]]
+    assert synced["deleted"]["patients"] == []
@@ -0,0 +1,21 @@
+from pymongo import ReadPreference
+
+import database
+
+
+def test_client_reads_primary_whatever_the_list_preference(monkeypatch):
+    monkeypatch.setenv("MONGO_READ_PREFERENCE", "secondaryPreferred")
+    assert "readPreference" not in database.client_options()
+    assert database.list_read_preference() == ReadPreference.SECONDARY_PREFERRED
+
+
+def test_list_preference_defaults_to_primary(monkeypatch):
+    monkeypatch.delenv("MONGO_READ_PREFERENCE", raising=False)
+    assert database.list_read_preference() == ReadPreference.PRIMARY
+
+
+def test_list_endpoints_use_the_configured_preference(server_db, monkeypatch):
+    import server
+
+    monkeypatch.setenv("MONGO_READ_PREFERENCE", "secondaryPreferred")
+    assert server.listing("patients").read_preference == ReadPreference.SECONDARY_PREFERRED
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from .conftest import PATIENT, png_bytes
+
+
+@pytest.fixture
+def exam(client):
+    patient = client.post("/api/patients", json=PATIENT).json()
+    return client.post("/api/exams", json={"patient_id": patient["id"]}).json()
+
+
+def test_batch_upload_reports_each_file(client, server_db, exam):
+    files = [
+        ("files", ("a.png", png_bytes(), "image/png")),
+        ("files", ("broken.jpg", b"not an image", "image/jpeg")),
+        ("files", ("truncated.png", png_bytes()[:60], "image/png")),
+        ("files", ("b.png", png_bytes("blue"), "image/png")),
+    ]
+    response = client.post(f"/api/exams/{exam['id']}/images/batch?organ=Baço", files=files)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["uploaded"], body["failed"]) == (2, 2)
+    assert [("image" in result, result["filename"]) for result in body["results"]] == [
+        (True, "a.png"), (False, "broken.jpg"), (False, "truncated.png"), (True, "b.png"),
+    ]
+
+    stored = asyncio.run(server_db.exams.find_one({"id": exam["id"]}))
+    assert [image["id"] for image in stored["images"]] == [
+        result["image"]["id"] for result in body["results"] if "image" in result
+    ]
+    assert stored["revision"] > exam.get("revision", 0)
+    first = body["results"][0]["image"]
+    assert client.get(f"/api/images/{first['id']}").content == png_bytes()
+
+
+def test_batch_upload_to_missing_exam(client):
+    files = [("files", ("a.png", png_bytes(), "image/png"))]
+    assert client.post("/api/exams/missing/images/batch", files=files).status_code == 404
+
+
+def test_batch_upload_file_limit(client, exam, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "IMAGE_BATCH_MAX_FILES", 1)
+    files = [("files", (f"{i}.png", png_bytes(), "image/png")) for i in range(2)]
+    assert client.post(f"/api/exams/{exam['id']}/images/batch", files=files).status_code == 400
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import migrate_datetimes
+
+
+@pytest.fixture
+def exams(db):
+    asyncio.run(db.exams.insert_many([
+        {"_id": 1, "exam_date": "2020-01-01T12:00:00+02:00"},
+        {"_id": 2, "exam_date": "2020-01-01T12:00:00"},
+        {"_id": 3, "exam_date": "ontem"},
+        {"_id": 4, "exam_date": datetime(2021, 5, 1, tzinfo=timezone.utc)},
+    ]))
+    return db.exams
+
+
+def migrate(collection, dry_run=False):
+    return asyncio.run(migrate_datetimes.migrate_field(collection, "exam_date", 2, dry_run))
+
+
+def dates(collection):
+    return {doc["_id"]: doc["exam_date"] for doc in asyncio.run(collection.find().to_list(None))}
+
+
+def test_strings_become_utc_dates_and_unparseable_values_stay(exams):
+    assert migrate(exams) == 2
+    assert dates(exams) == {
+        1: datetime(2020, 1, 1, 10, tzinfo=timezone.utc),
+        2: datetime(2020, 1, 1, 12, tzinfo=timezone.utc),
+        3: "ontem",
+        4: datetime(2021, 5, 1, tzinfo=timezone.utc),
+    }
+
+
+def test_second_run_changes_nothing(exams):
+    migrate(exams)
+    migrated = dates(exams)
+    assert migrate(exams) == 0
+    assert dates(exams) == migrated
+
+
+def test_dry_run_counts_without_writing(exams):
+    before = dates(exams)
+    assert migrate(exams, dry_run=True) == 2
+    assert dates(exams) == before
+
+
+@pytest.mark.parametrize("expires_at", [
+    lambda when: when,
+    # Licenses written before the migration hold ISO strings
+    lambda when: when.isoformat(),
+])
+def test_license_status_accepts_string_and_date_expiry(client, server_db, expires_at):
+    future = datetime.now(timezone.utc) + timedelta(days=30)
+    past = datetime.now(timezone.utc) - timedelta(days=30)
+    asyncio.run(server_db.licenses.insert_one({"is_used": True, "expires_at": expires_at(past)}))
+    assert client.get("/api/license/status").json()["is_active"] is False
+
+    asyncio.run(server_db.licenses.insert_one({"is_used": True, "expires_at": expires_at(future)}))
+    status = client.get("/api/license/status").json()
+    assert status["is_active"] is True
+    assert status["expires_at"].startswith(future.strftime("%Y-%m-%dT%H:%M"))
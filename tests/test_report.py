@@ -0,0 +1,90 @@
+import io
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+import report
+
+from .conftest import PATIENT
+
+LETTERHEAD = Path(__file__).resolve().parent.parent / "backend" / "uploads" / "letterheads" / "timbrado_padrao.docx"
+
+ORGANS = [
+    {"organ_name": "Fígado", "measurements": {"a": {"value": 3.1, "unit": "cm"}},
+     "report_text": "com **contornos regulares** e *ecotextura* homogênea, {MEDIDA}."},
+    {"organ_name": "Adrenal Esquerda", "report_text": "",
+     "measurements": {"a": {"value": 1, "unit": "cm"}, "b": {"value": 2, "unit": "cm"}, "c": {"value": 3, "unit": "cm"}}},
+    {"organ_name": "Baço", "measurements": {}, "report_text": "sem alterações"},
+    {"organ_name": "Rim", "measurements": {}, "report_text": ""},
+]
+
+
+def document_xml(settings, load_blob=lambda path: None, organs=ORGANS):
+    exam = {"exam_date": datetime(2024, 1, 2, tzinfo=timezone.utc), "organs_data": organs, "images": []}
+    data = report.render_exam_report(exam, PATIENT, settings, load_blob)
+    return zipfile.ZipFile(io.BytesIO(data)).read("word/document.xml")
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = report.OrganFragmentCache(16)
+    monkeypatch.setattr(report, "organ_fragment_cache", cache)
+    return cache
+
+
+@pytest.mark.parametrize("settings, load_blob", [
+    ({"clinic_name": "Clínica"}, lambda path: None),
+    # The bundled letterhead has no Heading 3 style, so sections use the fallback
+    ({"letterhead_path": "letterheads/timbrado_padrao.docx"}, lambda path: LETTERHEAD.read_bytes()),
+])
+def test_cached_sections_render_the_same_document(cache, settings, load_blob):
+    rendered = document_xml(settings, load_blob)
+    assert cache.misses == 3 and cache.hits == 0
+
+    assert document_xml(settings, load_blob) == rendered
+    assert cache.hits == 3
+
+
+def test_edited_organ_is_rendered_again(cache):
+    document_xml({"clinic_name": "Clínica"})
+    edited = [dict(organ) for organ in ORGANS]
+    edited[2]["report_text"] = "aumentado"
+    assert b"aumentado" in document_xml({"clinic_name": "Clínica"}, organs=edited)
+    assert cache.hits == 2 and cache.misses == 4
+
+
+def test_cache_evicts_least_recently_used():
+    cache = report.OrganFragmentCache(2)
+    for key in ("a", "b", "c"):
+        cache.put((None, key.encode()), [])
+    assert cache.get((None, b"a")) is None
+    assert cache.get((None, b"c")) == []
+
+
+def test_persisted_export_is_served_until_the_exam_changes(client, server_db, monkeypatch):
+    import storage
+
+    renders = []
+
+    def render(exam, patient, settings, load_blob):
+        renders.append(exam["id"])
+        return f"docx {len(renders)}".encode()
+
+    monkeypatch.setattr(report, "render_exam_report", render)
+    patient = client.post("/api/patients", json=PATIENT).json()
+    exam = client.post("/api/exams", json={"patient_id": patient["id"]}).json()
+    url = f"/api/exams/{exam['id']}/export?persist=true"
+
+    assert client.get(url).content == b"docx 1"
+    assert client.get(url).content == b"docx 1"
+    assert len(renders) == 1
+
+    client.put(f"/api/exams/{exam['id']}", json={"exam_weight": 4.2})
+    assert client.get(url).content == b"docx 2"
+
+    # A file that no longer matches its stamp is rendered again
+    storage.get_storage().put(f"reports/laudo_{exam['id']}.docx", b"partial")
+    assert client.get(url).content == b"docx 3"
+    assert client.get(url).content == b"docx 3"
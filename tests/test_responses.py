@@ -0,0 +1,20 @@
+from .conftest import PATIENT
+
+
+def test_trusted_reads_serialize_datetimes_like_models(client):
+    created = client.post("/api/patients", json=PATIENT).json()
+    assert created["created_at"].endswith("Z")
+
+    listed = client.get("/api/patients").json()[0]
+    fetched = client.get(f"/api/patients/{created['id']}").json()
+    synced = client.get("/api/sync").json()["patients"][0]
+    assert listed["created_at"] == fetched["created_at"] == synced["created_at"]
+    # BSON dates keep milliseconds only
+    assert listed["created_at"] == created["created_at"][:23] + "000Z"
+
+
+def test_exam_dates_match_between_write_and_read(client):
+    patient = client.post("/api/patients", json=PATIENT).json()
+    created = client.post("/api/exams", json={"patient_id": patient["id"], "exam_date": "2020-01-01T10:00:00Z"}).json()
+    fetched = client.get(f"/api/exams/{created['id']}").json()
+    assert created["exam_date"] == fetched["exam_date"] == "2020-01-01T10:00:00Z"
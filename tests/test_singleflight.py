@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test")
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [1] * 5
+    assert flight.stats() == {"calls": 5, "executions": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        retry = await flight.do("key", lambda: asyncio.sleep(0, result="ok"))
+        return results, retry
+
+    results, retry = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retry == "ok"
+
+
+def test_cancelled_caller_does_not_cancel_shared_work():
+    flight = SingleFlight("test")
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.01)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        await started.wait()
+        second = asyncio.ensure_future(flight.do("key", work))
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
@@ -0,0 +1,119 @@
+import io
+
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+import storage
+from storage import BlobNotFound, BlobStorage, LocalBlobStorage, MemoryBlobStorage, S3BlobStorage, key_from_path
+
+
+@pytest.mark.parametrize("path, key", [
+    ("images/a.jpg", "images/a.jpg"),
+    ("/app/backend/uploads/images/a.jpg", "images/a.jpg"),
+    ("/app/backend/uploads/letterheads/timbrado.docx", "letterheads/timbrado.docx"),
+    ("C:\\clinica\\backend\\uploads\\images\\a.jpg", "images/a.jpg"),
+    # Nested "uploads" directories: the last one is the storage root
+    ("/srv/uploads/app/uploads/images/a.jpg", "images/a.jpg"),
+    ("/data/images/a.jpg", "images/a.jpg"),
+])
+def test_key_from_path(path, key):
+    assert key_from_path(path) == key
+
+
+@pytest.mark.parametrize("path", ["../etc/passwd", "images/../../x", ""])
+def test_key_from_path_rejects_invalid_keys(path):
+    with pytest.raises(ValueError):
+        key_from_path(path)
+
+
+def test_blob_storage_is_abstract():
+    with pytest.raises(TypeError):
+        BlobStorage()
+
+
+@pytest.fixture(params=["local", "memory"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return LocalBlobStorage(tmp_path)
+    return MemoryBlobStorage()
+
+
+def test_put_get_delete(backend):
+    backend.put("images/a.jpg", b"data", "image/jpeg")
+    assert backend.exists("images/a.jpg")
+    assert backend.get("images/a.jpg") == b"data"
+
+    backend.put("images/a.jpg", b"new")
+    assert backend.get("images/a.jpg") == b"new"
+
+    backend.delete("images/a.jpg")
+    assert not backend.exists("images/a.jpg")
+    with pytest.raises(BlobNotFound):
+        backend.get("images/a.jpg")
+    # Deleting a missing key is not an error
+    backend.delete("images/a.jpg")
+
+
+def test_local_backend_serves_files_from_disk(tmp_path):
+    backend = LocalBlobStorage(tmp_path)
+    backend.put("images/a.jpg", b"data")
+    assert backend.local_path("images/a.jpg") == tmp_path / "images" / "a.jpg"
+    assert backend.local_path("images/missing.jpg") is None
+    assert list((tmp_path / "images").iterdir()) == [tmp_path / "images" / "a.jpg"]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    backend = S3BlobStorage("clinic", prefix="/vet/", region_name="us-east-1")
+    with Stubber(backend.client) as stubber:
+        yield backend, stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_s3_put_get_delete(s3):
+    backend, stubber = s3
+    stubber.add_response(
+        "put_object", {},
+        {"Bucket": "clinic", "Key": "vet/images/a.jpg", "Body": b"data", "ContentType": "image/jpeg"}
+    )
+    stubber.add_response(
+        "get_object", {"Body": StreamingBody(io.BytesIO(b"data"), 4)},
+        {"Bucket": "clinic", "Key": "vet/images/a.jpg"}
+    )
+    stubber.add_response("head_object", {}, {"Bucket": "clinic", "Key": "vet/images/a.jpg"})
+    stubber.add_response("delete_object", {}, {"Bucket": "clinic", "Key": "vet/images/a.jpg"})
+
+    backend.put("images/a.jpg", b"data", "image/jpeg")
+    assert backend.get("images/a.jpg") == b"data"
+    assert backend.exists("images/a.jpg")
+    backend.delete("images/a.jpg")
+
+
+def test_s3_missing_keys(s3):
+    backend, stubber = s3
+    stubber.add_client_error("get_object", "NoSuchKey", http_status_code=404)
+    stubber.add_client_error("head_object", "404", http_status_code=404)
+
+    with pytest.raises(BlobNotFound):
+        backend.get("images/missing.jpg")
+    assert not backend.exists("images/missing.jpg")
+
+
+def test_s3_rejects_keys_outside_the_prefix(s3):
+    backend, _ = s3
+    with pytest.raises(ValueError):
+        backend.put("../other-tenant/a.jpg", b"data")
+
+
+def test_create_storage_from_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    assert isinstance(storage.create_storage(), MemoryBlobStorage)
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("STORAGE_LOCAL_ROOT", str(tmp_path))
+    assert storage.create_storage().root == tmp_path
+    monkeypatch.setenv("STORAGE_BACKEND", "ftp")
+    with pytest.raises(ValueError):
+        storage.create_storage()
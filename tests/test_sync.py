@@ -0,0 +1,126 @@
+import asyncio
+
+import orjson
+import pytest
+
+import revisions
+
+
+def sync(server, since=0):
+    return orjson.loads(asyncio.run(server.sync_changes(since=since)).body)
+
+
+def test_stable_revision_stays_below_writes_in_flight(db):
+    async def scenario():
+        async with revisions.reserve(db) as first:
+            async with revisions.reserve(db) as second:
+                await db.patients.insert_one({"id": "b", "revision": second})
+            # The later write committed first; the earlier one is still pending
+            assert await revisions.stable_revision(db) < first
+            await db.patients.insert_one({"id": "a", "revision": first})
+        assert await revisions.stable_revision(db) == second
+
+    asyncio.run(scenario())
+
+
+def test_stable_revision_ignores_expired_leases(db, monkeypatch):
+    monkeypatch.setattr(revisions, "SYNC_LEASE_SECONDS", -1)
+
+    async def scenario():
+        async with revisions.reserve(db) as revision:
+            assert await revisions.stable_revision(db) == revision
+
+    asyncio.run(scenario())
+
+
+def test_sync_does_not_skip_interleaved_writes(server_db):
+    import server
+
+    async def write_patient(patient_id, revision):
+        await server_db.patients.insert_one({
+            "id": patient_id, "name": patient_id, "species": "dog", "breed": "x",
+            "weight": 1.0, "size": "small", "sex": "male", "revision": revision,
+        })
+
+    async def scenario():
+        # Writer A reserves first, writer B reserves later and commits first
+        async with revisions.reserve(server_db) as rev_a:
+            async with revisions.reserve(server_db) as rev_b:
+                await write_patient("b", rev_b)
+            during = orjson.loads((await server.sync_changes(since=0)).body)
+            await write_patient("a", rev_a)
+        after = orjson.loads((await server.sync_changes(since=during["watermark"])).body)
+        return rev_a, during, after
+
+    rev_a, during, after = asyncio.run(scenario())
+    assert during["watermark"] < rev_a
+    assert [p["id"] for p in during["patients"]] == []
+    assert {p["id"] for p in after["patients"]} == {"a", "b"}
+
+
+def test_sync_returns_changes_and_deletions_in_order(server_db):
+    import server
+
+    async def scenario():
+        first = await server.create_patient(server.PatientCreate(
+            name="Rex", species="dog", breed="x", weight=3, size="small", sex="male"))
+        second = await server.create_patient(server.PatientCreate(
+            name="Mia", species="cat", breed="y", weight=2, size="small", sex="female"))
+        await server.delete_patient(first.id)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    response = sync(server)
+    assert [p["id"] for p in response["patients"]] == [second.id]
+    assert response["deleted"]["patients"] == [first.id]
+    assert response["has_more"] is False
+    assert sync(server, response["watermark"])["patients"] == []
+
+
+def test_sync_backfills_revisions_after_a_failed_startup(server_db, monkeypatch):
+    import server
+
+    real = server.ensure_sync_revisions
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("MongoDB unreachable")
+        await real()
+
+    monkeypatch.setattr(server, "ensure_sync_revisions", flaky)
+
+    async def scenario():
+        await server_db.patients.insert_one({
+            "id": "legacy", "name": "Rex", "species": "dog", "breed": "x",
+            "weight": 1.0, "size": "small", "sex": "male",
+        })
+        with pytest.raises(ConnectionError):
+            await server.ensure_sync_ready()
+        return orjson.loads((await server.sync_changes(since=0)).body)
+
+    response = asyncio.run(scenario())
+    assert [p["id"] for p in response["patients"]] == ["legacy"]
+    assert len(attempts) == 2
+
+
+def test_default_data_takes_one_reservation_per_collection(server_db, monkeypatch):
+    import server
+
+    reservations = []
+    real_reserve = revisions.reserve
+
+    def counting_reserve(db, count=1):
+        reservations.append(count)
+        return real_reserve(db, count)
+
+    monkeypatch.setattr(revisions, "reserve", counting_reserve)
+    asyncio.run(server.initialize_defaults())
+
+    templates = asyncio.run(server_db.templates.count_documents({}))
+    references = asyncio.run(server_db.reference_values.count_documents({}))
+    assert reservations == [templates, references]
+    synced = sync(server)
+    revisions_seen = [doc["revision"] for name in ("templates", "reference_values") for doc in synced[name]]
+    assert sorted(revisions_seen) == list(range(1, templates + references + 1))